@@ -0,0 +1,133 @@
+import bisect
+import json
+import threading
+import time
+
+
+class AchievementRules:
+    """
+    Achievement catalog compiled for evaluation: achievements are grouped by
+    condition_type with their thresholds kept sorted, so the achievements a
+    metric value has reached are found with a single bisect.
+    """
+
+    def __init__(self, achievements):
+        self.achievements = achievements
+        self._thresholds = {}  # condition_type -> (sorted condition values, achievements in the same order)
+        for achievement in sorted(achievements, key=lambda a: a["condition_value"]):
+            values, rows = self._thresholds.setdefault(achievement["condition_type"], ([], []))
+            values.append(achievement["condition_value"])
+            rows.append(achievement)
+
+    def reached(self, metrics):
+        """
+        Returns the achievements whose threshold was crossed by the given
+        {condition_type: (old value, new value)} metrics, i.e. those above the
+        old value and at most the new one. An old value of None means every
+        threshold up to the new value. Metrics left out are not evaluated.
+        """
+        reached = []
+        for condition_type, (old, new) in metrics.items():
+            if new is None or condition_type not in self._thresholds:
+                continue
+            values, rows = self._thresholds[condition_type]
+            start = 0 if old is None else bisect.bisect_right(values, old)
+            reached.extend(rows[start:bisect.bisect_right(values, new)])
+        return reached
+
+
+class CompiledCatalog:
+    """
+    Immutable snapshot of one catalog version: the rows ordered by
+    condition_value, the compiled rules, and each achievement pre-serialized
+    so API responses only splice in the per-user "unlocked" flag.
+    """
+
+    def __init__(self, version, achievements, serialize):
+        self.version = version
+        self.achievements = achievements
+        self.rules = AchievementRules(achievements)
+        # Serialized objects without their closing brace
+        self._fragments = [(achievement["id"], serialize(achievement)[:-1]) for achievement in achievements]
+
+    def to_json(self, unlocked_ids):
+        """
+        Serializes the catalog as a JSON array with an "unlocked" flag on every achievement.
+        """
+        return "[" + ",".join(
+            f'{fragment},"unlocked":{"true" if achievement_id in unlocked_ids else "false"}}}'
+            for achievement_id, fragment in self._fragments
+        ) + "]"
+
+
+class AchievementCatalog:
+    """
+    Process-local cache of the achievement catalog, keyed on the version row in
+    achievement_catalog_version. The version is re-read at most every
+    check_interval seconds; when it changed, the catalog is reloaded.
+    """
+
+    def __init__(self, serialize=json.dumps, check_interval=10):
+        self.check_interval = check_interval
+        self._serialize = serialize
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._next_check = 0
+
+    def get(self, db):
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() < self._next_check:
+            return catalog
+        row = db.fetchone("SELECT version FROM achievement_catalog_version")
+        version = row["version"] if row else 0
+        with self._lock:
+            if self._catalog is None or self._catalog.version != version:
+                achievements = db.fetchall("SELECT * FROM achievements ORDER BY condition_value")
+                self._catalog = CompiledCatalog(version, achievements, self._serialize)
+            self._next_check = time.monotonic() + self.check_interval
+            return self._catalog
+
+    def rules(self, db):
+        return self.get(db).rules
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog = None
+
+
+def unlock_message(achievement):
+    return f"Achievement Unlocked: {achievement['name']} - {achievement['description']} {achievement['icon']}"
+
+
+def unlock_achievements(db, user_id, achievements):
+    """
+    Unlocks the given achievements for the user and notifies them about the ones
+    they did not have yet, in a single statement. Returns the newly unlocked messages.
+    """
+    if not achievements:
+        return []
+    rows = db.fetchall(
+        """
+        WITH candidates AS (
+            SELECT * FROM unnest(%s::uuid[], %s::text[]) AS c(achievement_id, message)
+        ),
+        unlocked AS (
+            INSERT INTO user_achievements (user_id, achievement_id)
+            SELECT %s, achievement_id FROM candidates
+            ON CONFLICT DO NOTHING
+            RETURNING achievement_id
+        )
+        INSERT INTO notifications (user_id, type, message)
+        SELECT %s, 'achievement', candidates.message
+        FROM unlocked
+        JOIN candidates USING (achievement_id)
+        RETURNING message
+        """,
+        (
+            [str(achievement["id"]) for achievement in achievements],
+            [unlock_message(achievement) for achievement in achievements],
+            user_id,
+            user_id
+        )
+    )
+    return [row["message"] for row in rows]
@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe, bounded LRU cache whose entries also expire after a TTL.
+    Keeps hit/miss/eviction counters so the cache can be sized from /api/metrics.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value for ttl seconds (the cache default when omitted),
+        evicting the least recently used entries once maxsize is reached.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._stats["invalidations"] += 1
+            return entry[1] if entry else None
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose value matches the predicate. Returns the number removed.
+        """
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+            self._stats["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+                "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+                **self._stats,
+            }
+
+
+class _Flight:
+    """One in-progress computation that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RefreshingCache:
+    """
+    Cache for values that are expensive to recompute. Entries are fresh for
+    ttl seconds and are then served stale for up to stale_ttl more seconds
+    while a single background thread recomputes them. Concurrent misses for
+    the same key share one computation instead of each running their own.
+    """
+
+    def __init__(self, maxsize=256, ttl=10, stale_ttl=30):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = TTLCache(maxsize, ttl + stale_ttl)  # key -> (fresh_until, value)
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+        self._stats = {
+            "stale_hits": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "errors": 0,
+        }
+
+    def get(self, key, compute):
+        """
+        Returns the cached value for key, calling compute() to produce it on a
+        miss and in the background once the cached value has gone stale.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            fresh_until, value = entry
+            if fresh_until <= time.monotonic():
+                with self._lock:
+                    self._stats["stale_hits"] += 1
+                self._refresh_in_background(key, compute)
+            return value
+
+        flight, leader = self._join_flight(key)
+        if leader:
+            self._run(key, flight, compute)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _join_flight(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def _run(self, key, flight, compute):
+        try:
+            flight.value = compute()
+            self._entries.set(key, (time.monotonic() + self.ttl, flight.value))
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self._stats["refreshes"] += 1
+            flight.done.set()
+
+    def _refresh_in_background(self, key, compute):
+        flight, leader = self._join_flight(key)
+        if not leader:
+            return
+
+        def refresh():
+            self._run(key, flight, compute)
+            if flight.error is not None:
+                print(f"Background refresh of {key!r} failed: {flight.error}")
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            own = dict(self._stats)
+        return {**self._entries.stats(), **own}
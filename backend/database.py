@@ -1,16 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became available in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe, process-wide pool of psycopg2 connections.
+
+    Connections idle for longer than idle_timeout are closed (down to minconn),
+    connections older than max_lifetime are recycled, and every checkout of a
+    connection that has been idle for more than health_check_after seconds is
+    probed with SELECT 1 before being handed out.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, idle_timeout=300, max_lifetime=3600,
+                 wait_timeout=10, health_check_after=30, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, returned_at)], most recently returned last
+        self._created_at = {}  # id(conn) -> creation time of every open connection
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "closed": 0,
+            "failed_health_checks": 0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        conn.autocommit = False
+        self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._stats["closed"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_reusable(self, conn, created_at, now):
+        return not conn.closed and now - created_at <= self.max_lifetime
+
+    def _probe(self, conn):
+        # Called without holding the lock: the round trip can take as long as the network does
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prune_idle(self, now):
+        # Oldest returns sit at the front of the list
+        while len(self._idle) > self.minconn and now - self._idle[0][2] > self.idle_timeout:
+            conn, _, _ = self._idle.pop(0)
+            self._discard(conn)
+
+    def getconn(self):
+        """
+        Checks a connection out of the pool, opening a new one if the pool is
+        below maxconn, otherwise waiting up to wait_timeout for a return.
+        """
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune_idle(now)
+                while self._idle:
+                    # A popped connection is no longer idle, so no other caller can take it
+                    conn, created_at, returned_at = self._idle.pop()
+                    if not self._is_reusable(conn, created_at, now):
+                        self._discard(conn)
+                        continue
+                    if now - returned_at <= self.health_check_after:
+                        return self._checked_out(conn, start, waited)
+                    self._cond.release()
+                    try:
+                        healthy = self._probe(conn)
+                    finally:
+                        self._cond.acquire()
+                    if healthy:
+                        return self._checked_out(conn, start, waited)
+                    self._stats["failed_health_checks"] += 1
+                    self._discard(conn)
+                    now = time.monotonic()
+                if len(self._created_at) < self.maxconn:
+                    # Reserve the slot before connecting so concurrent callers respect maxconn
+                    placeholder = object()
+                    self._created_at[id(placeholder)] = now
+                    try:
+                        self._cond.release()
+                        try:
+                            conn = self._connect()
+                        finally:
+                            self._cond.acquire()
+                    finally:
+                        self._created_at.pop(id(placeholder), None)
+                    self._created_at[id(conn)] = time.monotonic()
+                    return self._checked_out(conn, start, waited)
+                remaining = self.wait_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.wait_timeout}s "
+                        f"({self.maxconn} in use)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+    def _checked_out(self, conn, start, waited):
+        elapsed = time.monotonic() - start
+        self._stats["checkouts"] += 1
+        if waited:
+            self._stats["waits"] += 1
+        self._stats["wait_time_total"] += elapsed
+        self._stats["wait_time_max"] = max(self._stats["wait_time_max"], elapsed)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns a connection to the pool. Any open transaction is rolled back;
+        broken or expired connections are closed instead of being reused.
+        """
+        # Roll back before taking the lock, like the health check in getconn
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if id(conn) not in self._created_at:
+                return
+            now = time.monotonic()
+            if discard or conn.closed or now - self._created_at[id(conn)] > self.max_lifetime:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, self._created_at[id(conn)], now))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """
+        Returns a snapshot of pool saturation and checkout wait-time statistics.
+        """
+        with self._cond:
+            in_use = len(self._created_at) - len(self._idle)
+            checkouts = self._stats["checkouts"]
+            return {
+                "size": len(self._created_at),
+                "idle": len(self._idle),
+                "in_use": in_use,
+                "max_size": self.maxconn,
+                "saturation": in_use / self.maxconn if self.maxconn else 0.0,
+                "checkouts": checkouts,
+                "waits": self._stats["waits"],
+                "timeouts": self._stats["timeouts"],
+                "avg_wait_ms": (self._stats["wait_time_total"] / checkouts * 1000) if checkouts else 0.0,
+                "max_wait_ms": self._stats["wait_time_max"] * 1000,
+                "created": self._stats["created"],
+                "closed": self._stats["closed"],
+                "failed_health_checks": self._stats["failed_health_checks"],
+            }
+
+
 class PostgresHandler:
-    def __init__(self, host, user, password, database, port=5432):
-        self.conn = psycopg2.connect(
-            host=host,
-            user=user,
-            password=password,
-            dbname=database,
-            port=port
-        )
-        self.conn.autocommit = False
+    def __init__(self, host=None, user=None, password=None, database=None, port=5432, pool=None):
+        self._pool = pool
+        if pool is not None:
+            self.conn = pool.getconn()
+        else:
+            self.conn = psycopg2.connect(
+                host=host,
+                user=user,
+                password=password,
+                dbname=database,
+                port=port
+            )
+            self.conn.autocommit = False
 
     def execute(self, query, params=None):
         with self.conn.cursor() as cursor:
@@ -32,8 +226,87 @@ class PostgresHandler:
             return cursor.fetchone()
 
     def close(self):
+        """
+        Releases the connection: pooled connections go back to the pool,
+        direct connections are closed.
+        """
         if self.conn:
-            self.conn.close()
+            if self._pool is not None:
+                self._pool.putconn(self.conn)
+            else:
+                self.conn.close()
+            self.conn = None
 
     def commit(self):
         self.conn.commit()
+
+
+class UnitOfWork(PostgresHandler):
+    """
+    PostgresHandler whose statements all run in one transaction.
+    The pooled connection is only checked out on first use, and the owner
+    commits or rolls back once before calling close().
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+        self._after_commit = []
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self._pool.getconn()
+        return self._conn
+
+    @property
+    def is_open(self):
+        return self._conn is not None
+
+    def execute(self, query, params=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(query, params)
+
+    def after_commit(self, callback):
+        """
+        Runs callback once this unit of work commits, e.g. to drop cached copies
+        of rows it changed. Callbacks are discarded if the work is rolled back.
+        """
+        self._after_commit.append(callback)
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Lets a failing block be undone without aborting the whole unit of work.
+        """
+        with self.conn.cursor() as cursor:
+            cursor.execute("SAVEPOINT unit_of_work")
+        pending = len(self._after_commit)
+        try:
+            yield self
+        except Exception:
+            with self.conn.cursor() as cursor:
+                cursor.execute("ROLLBACK TO SAVEPOINT unit_of_work")
+            del self._after_commit[pending:]
+            raise
+        else:
+            with self.conn.cursor() as cursor:
+                cursor.execute("RELEASE SAVEPOINT unit_of_work")
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        if self._conn is not None:
+            self._conn.rollback()
+        self._after_commit = []
+
+    def close(self):
+        self._after_commit = []
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
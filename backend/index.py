@@ -1,9 +1,29 @@
-from flask import Flask, jsonify, request
+import click
+from flask import Flask, g, jsonify, request
 from flask_cors import CORS
-from .database import PostgresHandler
+from werkzeug.test import EnvironBuilder
+from .achievements import AchievementCatalog, unlock_achievements
+from .cache import RefreshingCache, TTLCache
+from .database import ConnectionPool, PostgresHandler, UnitOfWork
+from .migrate import migrate
+from .pubsub import NotificationHub
+from .retention import (
+    DEFAULT_NOTIFICATION_RETENTION, drop_expired_partitions, ensure_partitions, is_partitioned,
+    parse_retention_policy, partition_notifications, purge_expired_chunk
+)
+from .sessions import SessionTokens
+from .weather import OPEN_METEO_URL, CircuitBreaker, WeatherClient
+from . import weather_stub
 from dotenv import load_dotenv
 
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import queue
+import statistics
+import threading
+import time
 import uuid
 import os
 import sys
@@ -19,22 +39,207 @@ CORS(app, supports_credentials=True, origins=[
     "https://tamagotchi.moekyun.me"  # Added specific domain without wildcard
 ])
 
+def database_settings():
+    """
+    Connection settings for the Postgres database, read from the environment.
+    """
+    return {
+        "host": os.environ.get("PG_HOST"),
+        "user": os.environ.get("PG_USER"),
+        "password": os.environ.get("PG_PASSWORD"),
+        "dbname": os.environ.get("PG_DATABASE"),
+        "port": 5432
+    }
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_database_pool():
+    """
+    Returns the process-wide Postgres connection pool, creating it on first use.
+    Sizing and recycling are configured through the PG_POOL_* environment variables.
+    """
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    minconn=int(os.environ.get("PG_POOL_MIN", 1)),
+                    maxconn=int(os.environ.get("PG_POOL_MAX", 10)),
+                    idle_timeout=float(os.environ.get("PG_POOL_IDLE_TIMEOUT", 300)),
+                    max_lifetime=float(os.environ.get("PG_POOL_MAX_LIFETIME", 3600)),
+                    wait_timeout=float(os.environ.get("PG_POOL_WAIT_TIMEOUT", 10)),
+                    **database_settings()
+                )
+    return _db_pool
+
 def create_database_connection():
     """
-    Creates an authenticated database connection (Postgres)
+    Checks out an authenticated database connection (Postgres) from the pool.
+    Calling close() on the handler returns the connection to the pool.
+    """
+    return PostgresHandler(pool=get_database_pool())
+
+def get_db():
+    """
+    Returns the request-scoped unit of work shared by cookie_check, the helpers
+    and the route body. The pooled connection is opened on first use and the
+    transaction is committed or rolled back once when the request finishes.
+    """
+    if "db" not in g:
+        g.db = UnitOfWork(get_database_pool())
+    return g.db
+
+def release_request_db():
+    """
+    Commits the request's unit of work and returns its connection to the pool
+    before the request ends, for routes that go on to wait on something else.
+    Inside /api/batch this does nothing: sub-requests share the batch's unit
+    of work, which only the batch may settle.
+    """
+    if g.get("in_batch"):
+        return
+    db = g.get("db")
+    if db is not None:
+        db.commit()
+        db.close()
+
+@app.after_request
+def commit_request_db(response):
+    """
+    Commits the request's unit of work for successful responses and rolls it back otherwise.
+    """
+    db = g.get("db")
+    if db is None or not db.is_open or g.get("in_batch"):
+        # Batch sub-requests share the batch's unit of work, which /api/batch settles itself
+        return response
+    if response.status_code >= 400:
+        db.rollback()
+        return response
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        response = jsonify({
+            "status": "error",
+            "message": str(e)
+        })
+        response.status_code = 500
+    return response
+
+@app.teardown_request
+def close_request_db(exc):
+    """
+    Returns the request's connection to the pool, rolling back anything left uncommitted.
+    """
+    if g.get("in_batch"):
+        return
+    db = g.pop("db", None)
+    if db is not None:
+        db.close()
+
+# Resolved sessions, keyed by a hash of the cookie value so raw session ids are not kept in memory.
+# The cache is per worker process: a logout, profile change or account deletion only clears
+# the worker that handled it, and the others keep serving their copy for up to
+# SESSION_CACHE_TTL seconds. Keep the TTL short.
+session_cache = TTLCache(
+    maxsize=int(os.environ.get("SESSION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("SESSION_CACHE_TTL", 60))
+)
+
+def session_cache_key(session_cookie):
+    return hashlib.sha256(session_cookie.encode()).hexdigest()
+
+def invalidate_user_sessions(user_id):
+    """
+    Drops every cached session belonging to the user, e.g. after their profile changes.
+    The cache is only cleared once the request's changes are committed, so a concurrent
+    request cannot cache the old row again in between.
+    """
+    g.pop("session_user", None)
+    get_db().after_commit(
+        lambda: session_cache.discard_where(lambda cached: str(cached["id"]) == str(user_id))
+    )
+
+# "db" keeps sessions in the cookies table; "signed" issues HMAC-signed tokens that
+# cookie_check verifies without a database lookup. Existing database sessions keep
+# working in "signed" mode until they expire. "signed" requires a SESSION_SECRET of at
+# least 32 bytes and refuses to start without one.
+SESSION_MODE = os.environ.get("SESSION_MODE", "db")
+session_tokens = SessionTokens(os.environ.get("SESSION_SECRET")) if SESSION_MODE == "signed" else None
+
+# Per-user session generations for signed tokens. Logout bumps the generation in the
+# database, which signs the user out on every device, not just the current one;
+# other workers keep accepting the old tokens until their cached value expires
+# (SESSION_GENERATION_TTL seconds).
+session_generations = TTLCache(
+    maxsize=int(os.environ.get("SESSION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("SESSION_GENERATION_TTL", 30))
+)
+
+def current_session_generation(user_id):
+    """
+    Returns the user's session generation, or -1 if the user no longer exists.
     """
-    return PostgresHandler(
-        host=os.environ.get("PG_HOST"),
-        user=os.environ.get("PG_USER"),
-        password=os.environ.get("PG_PASSWORD"),
-        database=os.environ.get("PG_DATABASE"),
-        port=5432
+    generation = session_generations.get(user_id)
+    if generation is None:
+        row = get_db().fetchone("SELECT session_generation FROM users WHERE id = %s", (user_id,))
+        generation = row["session_generation"] if row else -1
+        session_generations.set(user_id, generation)
+    return generation
+
+def issue_signed_session(user, generation):
+    """
+    Creates a signed session token for the user. Returns the token and its expiry.
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(days=7)  # Cookie valid for 7 days
+    return session_tokens.issue(user, generation, expires_at), expires_at
+
+def check_signed_session(token, tokens=None):
+    """
+    Verifies a signed session token and returns the user it carries, or None if it
+    is invalid, expired or revoked by a newer session generation.
+    """
+    payload = (tokens or session_tokens).verify(token)
+    if not payload or payload["gen"] != current_session_generation(payload["uid"]):
+        return None
+    return SessionTokens.to_user(payload)
+
+# The hot lookups below are module-level so tests/test_index_usage.py can EXPLAIN
+# exactly the statements the routes send.
+SESSION_LOOKUP_SQL = """
+    SELECT users.id, users.email, users.display_name, users.avatar_url, users.timezone,
+        cookies.expires_at
+    FROM cookies
+    JOIN users ON cookies.user_id = users.id
+    WHERE cookies.cookie_value = %s AND cookies.expires_at > NOW()
+"""
+
+def check_db_session(session_cookie):
+    """
+    Resolves a database-backed session cookie to its user, or None if it is unknown or expired.
+    """
+    cache_key = session_cache_key(session_cookie)
+    cached_user = session_cache.get(cache_key)
+    if cached_user is not None:
+        return dict(cached_user)
+
+    user = get_db().fetchone(SESSION_LOOKUP_SQL, (session_cookie,))
+    if not user:
+        return None
+    expires_at = user.pop("expires_at")
+    session_cache.set(
+        cache_key,
+        dict(user),
+        ttl=min(session_cache.ttl, (expires_at - datetime.now(timezone.utc)).total_seconds())
     )
+    return user
 
 def cookie_check(session_cookie):
     """
     Validates the session cookie and retrieves the associated user.
     Returns the user object if valid, or a tuple with an error response and status code if invalid.
+    Resolved sessions are cached in-process until the cache TTL or the cookie expiry, whichever is sooner.
     """
     if not session_cookie:
         return jsonify({
@@ -42,31 +247,28 @@ def cookie_check(session_cookie):
             "message": "Authentication required."
         }), 401, None
 
-    db = create_database_connection()
+    # Sub-requests of a batch share the session resolved for the batch
+    resolved = g.get("session_user")
+    if resolved and resolved[0] == session_cookie:
+        return None, None, resolved[1]
+
     try:
-        user = db.fetchone(
-            """
-            SELECT users.id, users.email, users.display_name, users.avatar_url, users.timezone
-            FROM cookies
-            JOIN users ON cookies.user_id = users.id
-            WHERE cookies.cookie_value = %s AND cookies.expires_at > NOW()
-            """,
-            (session_cookie,)
-        )
+        if SESSION_MODE == "signed" and SessionTokens.looks_signed(session_cookie):
+            user = check_signed_session(session_cookie)
+        else:
+            user = check_db_session(session_cookie)
         if not user:
             return jsonify({
                 "status": "error",
                 "message": "Invalid or expired session."
             }), 401, None
+        g.session_user = (session_cookie, user)
         return None, None, user  # No error, return the user object
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500, None
-    finally:
-        db.close()
-
 
 @app.route("/api/info")
 def check_db():
@@ -78,7 +280,7 @@ def check_db():
             - On success: status "ok", message, and commit SHA with HTTP 200.
             - On failure: status "error", error message, and commit SHA with HTTP 500.
     """
-    db = create_database_connection()
+    db = get_db()
     try:
         db.execute("SELECT 1")
         commit_sha = os.getenv("VERCEL_GIT_COMMIT_SHA", "unknown/local_dev")
@@ -95,8 +297,36 @@ def check_db():
             "message": str(e),
             "commit": os.getenv("VERCEL_GIT_COMMIT_SHA", "unknown/local_dev")
         }), 500
-    finally:
-        db.close()
+
+
+# Bearer token for /api/metrics; the endpoint is disabled while this is unset
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+@app.route("/api/metrics")
+def get_metrics():
+    """
+    Returns in-process runtime statistics for this worker, such as connection
+    pool saturation and checkout wait times.
+    Requires an "Authorization: Bearer <METRICS_TOKEN>" header.
+    """
+    if not METRICS_TOKEN:
+        return jsonify({
+            "status": "error",
+            "message": "Metrics are disabled."
+        }), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({
+            "status": "error",
+            "message": "Invalid metrics token."
+        }), 401
+    return jsonify({
+        "status": "ok",
+        "db_pool": get_database_pool().stats(),
+        "session_cache": session_cache.stats(),
+        "leaderboard_cache": leaderboard_cache.stats(),
+        "weather_cache": weather_client.stats(),
+        "notification_hub": notification_hub.stats()
+    }), 200
 
 
 @app.route("/api/register", methods=["POST"])
@@ -123,7 +353,7 @@ def register_user():
     # Hash the password
     hashed_password = generate_password_hash(password)
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Insert user into the users table
         db.execute(
@@ -164,8 +394,6 @@ def register_user():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/authenticate", methods=["POST"])
@@ -186,10 +414,13 @@ def authenticate_user():
     email = data["email"]
     password = data["password"]
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Fetch user and password hash
-        user = db.fetchone("SELECT id FROM users WHERE email = %s", (email,))
+        user = db.fetchone(
+            "SELECT id, email, display_name, avatar_url, timezone FROM users WHERE email = %s",
+            (email,)
+        )
         if not user:
             return jsonify({
                 "status": "error",
@@ -202,14 +433,18 @@ def authenticate_user():
                 "status": "error",
                 "message": "Invalid email or password."
             }), 401
-        # Generate a session cookie
-        cookie_value = str(uuid.uuid4())
-        expires_at = datetime.utcnow() + timedelta(days=7)  # Cookie valid for 7 days
-        # Insert the cookie into the database
-        db.execute(
-            "INSERT INTO cookies (user_id, cookie_value, expires_at) VALUES (%s, %s, %s)",
-            (user_id, cookie_value, expires_at)
-        )
+        if SESSION_MODE == "signed":
+            # Signed token, nothing to store
+            cookie_value, expires_at = issue_signed_session(user, current_session_generation(user_id))
+        else:
+            # Generate a session cookie
+            cookie_value = str(uuid.uuid4())
+            expires_at = datetime.utcnow() + timedelta(days=7)  # Cookie valid for 7 days
+            # Insert the cookie into the database
+            db.execute(
+                "INSERT INTO cookies (user_id, cookie_value, expires_at) VALUES (%s, %s, %s)",
+                (user_id, cookie_value, expires_at)
+            )
         # Return the session cookie
         response = jsonify({
             "status": "ok",
@@ -224,9 +459,379 @@ def authenticate_user():
             "status": "error",
             "message": str(e)
         }), 500
+
+
+# Runs side work of a request (such as upstream calls) next to its database queries
+background_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BACKGROUND_WORKERS", 8)),
+    thread_name_prefix="background"
+)
+
+@app.route("/api/bootstrap", methods=["GET"])
+def bootstrap():
+    """
+    Returns everything the dashboard needs on load in one document: profile,
+    stats, pet, location, weather, unread notification count, settings and habits.
+    Authenticates once and reads the user-level data in a single statement;
+    the weather is fetched concurrently with the habits query when it has not
+    been prefetched.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    db = get_db()
+    try:
+        check_and_reset_streak(db, user["id"])
+
+        row = db.fetchone(
+            f"""
+            WITH created_settings AS (
+                INSERT INTO user_settings (user_id) VALUES (%(user_id)s)
+                ON CONFLICT (user_id) DO NOTHING
+                RETURNING notifications, dark_mode, sound, email_updates, location
+            ),
+            settings AS (
+                SELECT notifications, dark_mode, sound, email_updates, location
+                FROM user_settings WHERE user_id = %(user_id)s
+                UNION ALL
+                SELECT * FROM created_settings
+            )
+            SELECT
+                us.current_streak, us.longest_streak, us.total_habits_completed, us.lifetime_habits_completed,
+                p.id AS pet_id, p.name AS pet_name, p.type AS pet_type, {pet_vitals_sql("p")}, p.xp, p.lvl,
+                d.bio, d.location, d.interests, d.favorite_pet_type, d.join_date,
+                g.latitude, g.longitude, w.weather,
+                w.fetched_at > NOW() - make_interval(secs => %(weather_ttl)s) AS weather_fresh,
+                s.notifications, s.dark_mode, s.sound, s.email_updates, s.location AS location_sharing,
+                COALESCE(nc.unread, 0) AS unread_count
+            FROM users u
+            LEFT JOIN user_stats us ON us.user_id = u.id
+            LEFT JOIN pets p ON p.user_id = u.id
+            LEFT JOIN user_descriptions d ON d.user_id = u.id
+            LEFT JOIN user_geolocations g ON g.user_id = u.id
+            {PREFETCHED_WEATHER_JOIN}
+            LEFT JOIN notification_counters nc ON nc.user_id = u.id
+            LEFT JOIN settings s ON TRUE
+            WHERE u.id = %(user_id)s
+            """,
+            {"user_id": user["id"], "weather_ttl": weather_client.cache.ttl, "cell_size": weather_client.cell_degrees}
+        )
+
+        has_location = row["latitude"] is not None
+        weather = row["weather"] if row["weather_fresh"] else None
+        weather_future = None
+        if has_location and weather is None:
+            if WEATHER_SOURCE == "on-demand":
+                weather_future = background_executor.submit(
+                    weather_client.current, row["latitude"], row["longitude"], row["weather"]
+                )
+            else:
+                weather = row["weather"] or weather_client.fallback
+
+        habits = db.fetchall(HABITS_LIST_SQL, (user["id"],))
+        today = datetime.utcnow().date()
+        for h in habits:
+            h["completed"] = h["last_completed_at"].date() == today if h["last_completed_at"] else False
+
+        if weather_future is not None:
+            weather = weather_future.result()
+
+        has_pet = row["pet_id"] is not None
+        return jsonify({
+            "status": "ok",
+            "data": {
+                "user": {
+                    "id": user["id"],
+                    "email": user["email"],
+                    "display_name": user["display_name"],
+                    "avatar_url": user["avatar_url"],
+                    "timezone": user["timezone"]
+                },
+                "stats": {
+                    "current_streak": row["current_streak"] or 0,
+                    "longest_streak": row["longest_streak"] or 0,
+                    "total_habits_completed": row["total_habits_completed"] or 0,
+                    "lifetime_habits_completed": row["lifetime_habits_completed"] or 0
+                },
+                "has_pet": has_pet,
+                "pet": {
+                    "name": row["pet_name"],
+                    "type": row["pet_type"],
+                    "happiness": row["happiness"],
+                    "health": row["health"],
+                    "xp": row["xp"],
+                    "lvl": row["lvl"]
+                } if has_pet else None,
+                "profile": {
+                    "bio": row["bio"],
+                    "location": row["location"],
+                    "interests": row["interests"] or [],
+                    "favorite_pet_type": row["favorite_pet_type"],
+                    "join_date": row["join_date"].isoformat() if row["join_date"] else None
+                },
+                "has_location": has_location,
+                "weather": weather,
+                "unread_count": row["unread_count"],
+                "settings": {
+                    "notifications": row["notifications"],
+                    "darkMode": row["dark_mode"],
+                    "sound": row["sound"],
+                    "emailUpdates": row["email_updates"],
+                    "location": row["location_sharing"]
+                },
+                "habits": habits
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", 20))
+BATCH_METHODS = {"GET", "POST", "PUT", "DELETE"}
+
+class BatchRequestFailed(Exception):
+    """Raised inside a sub-request's savepoint so its changes are rolled back."""
+
+def dispatch_batch_request(sub_request, cookie_header):
+    """
+    Runs one batch sub-request through the regular routes in-process.
+    It shares the batch's g, and with it the unit of work and resolved session.
+    Returns (status code, body, Set-Cookie headers).
+    """
+    builder = EnvironBuilder(
+        path=sub_request["path"],
+        method=sub_request.get("method", "GET").upper(),
+        json=sub_request.get("body"),
+        headers={"Cookie": cookie_header} if cookie_header else None
+    )
+    try:
+        with app.request_context(builder.get_environ()):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:
+                response = jsonify({"status": "error", "message": str(e)})
+                response.status_code = 500
     finally:
-        db.close()
+        builder.close()
+    if response.is_streamed:
+        # Streams such as /api/notifications/stream never end, so they cannot be collected
+        response.close()
+        return 400, {
+            "status": "error",
+            "message": "Streaming endpoints cannot be used in a batch."
+        }, []
+    body = response.get_json(silent=True)
+    if body is None:
+        body = response.get_data(as_text=True)
+    return response.status_code, body, response.headers.getlist("Set-Cookie")
+
+@app.route("/api/batch", methods=["POST"])
+def batch():
+    """
+    Runs an ordered list of {method, path, body} sub-requests against the API
+    in one round trip and returns their {status, body} results in order.
+    Every sub-request runs in its own savepoint, so a failing one does not undo
+    the others. With "atomic": true the batch stops at the first failure and
+    nothing is committed.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    data = request.get_json()
+    sub_requests = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({
+            "status": "error",
+            "message": "'requests' must be a non-empty list."
+        }), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({
+            "status": "error",
+            "message": f"A batch can contain at most {BATCH_MAX_REQUESTS} requests."
+        }), 400
+    for sub_request in sub_requests:
+        if (not isinstance(sub_request, dict)
+                or str(sub_request.get("method", "GET")).upper() not in BATCH_METHODS
+                or not str(sub_request.get("path", "")).startswith("/api/")
+                or sub_request["path"].split("?")[0].rstrip("/") == "/api/batch"):
+            return jsonify({
+                "status": "error",
+                "message": "Every request needs a method and an /api/ path other than /api/batch."
+            }), 400
+
+    atomic = bool(data.get("atomic"))
+    cookie_header = request.headers.get("Cookie")
+    db = get_db()
+    results = []
+    cookies = []
+    g.in_batch = True
+    try:
+        for sub_request in sub_requests:
+            if atomic:
+                status, body, set_cookies = dispatch_batch_request(sub_request, cookie_header)
+                results.append({"status": status, "body": body})
+                if status >= 400:
+                    # The error status makes the request teardown roll the whole batch back
+                    return jsonify({
+                        "status": "error",
+                        "message": f"Request {len(results) - 1} failed, no changes were saved.",
+                        "results": results
+                    }), status
+                cookies.extend(set_cookies)
+                continue
+            try:
+                with db.savepoint():
+                    status, body, set_cookies = dispatch_batch_request(sub_request, cookie_header)
+                    if status >= 400:
+                        raise BatchRequestFailed()
+                cookies.extend(set_cookies)
+            except BatchRequestFailed:
+                pass
+            results.append({"status": status, "body": body})
+
+        response = jsonify({"status": "ok", "results": results})
+        # Pass on cookies set by sub-requests, e.g. a reissued session
+        for cookie in cookies:
+            response.headers.add("Set-Cookie", cookie)
+        return response, 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        g.in_batch = False
+
+SYNC_TABLES = ("habits", "pets", "user_stats", "notifications", "friends")
+
+@app.route("/api/sync", methods=["GET"])
+def sync():
+    """
+    Returns the user's habits, pet, stats, notifications and friends that changed
+    since ?since=<cursor>, the ids of the ones deleted since then, and the cursor
+    to pass next time. Without a cursor, or with one older than the retained
+    tombstones or newer than any issued ("reset": true), every row is returned. Clients apply the
+    deletions first and then upsert the changes; rows may be sent again in a
+    later sync.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    since = request.args.get("since")
+    # Cursors are transaction ids, unsigned 64-bit integers
+    if since is not None and not (since.isascii() and since.isdigit() and int(since) < 2 ** 64):
+        return jsonify({
+            "status": "error",
+            "message": "Invalid sync cursor."
+        }), 400
+
+    db = get_db()
+    try:
+        check_and_reset_streak(db, user["id"])
+
+        # Taken before reading: anything that was not yet committed at this point
+        # belongs to a transaction at or above the new cursor and is sent next time
+        state = db.fetchone(
+            """
+            SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS cursor,
+                %(since)s::xid8 <= pruned_xid
+                    OR %(since)s::xid8 > pg_snapshot_xmin(pg_current_snapshot()) AS expired
+            FROM sync_horizon
+            """,
+            {"since": since or "0"}
+        )
+        # A cursor this server never issued (from the future) also gets a full resync
+        reset = since is not None and state["expired"]
+        if reset:
+            since = None
+        params = {"user_id": user["id"], "since": since or "0"}
+
+        habits = db.fetchall(
+            """
+            SELECT id, name, recurrence_type AS recurrence, created_at, last_completed_at
+            FROM habits
+            WHERE user_id = %(user_id)s AND change_xid >= %(since)s::xid8
+            """,
+            params
+        )
+        today = datetime.utcnow().date()
+        for h in habits:
+            h["completed"] = h["last_completed_at"].date() == today if h["last_completed_at"] else False
+
+        pets = db.fetchall(
+            f"""
+            SELECT id, name, type, {pet_vitals_sql()}, xp, lvl,
+                vitals_updated_at, happiness_decay_rate, health_decay_rate
+            FROM pets
+            WHERE user_id = %(user_id)s AND change_xid >= %(since)s::xid8
+            """,
+            params
+        )
+        user_stats = db.fetchall(
+            """
+            SELECT current_streak, longest_streak, total_habits_completed, lifetime_habits_completed, last_completed_at
+            FROM user_stats
+            WHERE user_id = %(user_id)s AND change_xid >= %(since)s::xid8
+            """,
+            params
+        )
+        notifications = db.fetchall(
+            """
+            SELECT id, type, message, read, created_at
+            FROM notifications
+            WHERE user_id = %(user_id)s AND change_xid >= %(since)s::xid8
+            ORDER BY created_at DESC
+            """,
+            params
+        )
+        friends = db.fetchall(
+            """
+            SELECT f.friend_id AS id, f.created_at
+            FROM friends f
+            WHERE f.user_id = %(user_id)s AND f.change_xid >= %(since)s::xid8
+            UNION
+            SELECT f.user_id, f.created_at
+            FROM friends f
+            WHERE f.friend_id = %(user_id)s AND f.change_xid >= %(since)s::xid8
+            """,
+            params
+        )
+
+        deleted = {table: [] for table in SYNC_TABLES}
+        if since is not None:
+            for row in db.fetchall(
+                """
+                SELECT DISTINCT table_name, row_id
+                FROM deleted_rows
+                WHERE user_id = %(user_id)s AND change_xid >= %(since)s::xid8
+                """,
+                params
+            ):
+                deleted[row["table_name"]].append(row["row_id"])
 
+        return jsonify({
+            "status": "ok",
+            "cursor": state["cursor"],
+            "reset": reset,
+            "changes": {
+                "habits": habits,
+                "pets": pets,
+                "user_stats": user_stats,
+                "notifications": notifications,
+                "friends": friends
+            },
+            "deleted": deleted
+        }), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
 
 @app.route("/api/profile", methods=["GET"])
 def get_profile():
@@ -240,7 +845,7 @@ def get_profile():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get user stats
         stats = db.fetchone(
@@ -252,7 +857,7 @@ def get_profile():
 
         # Get pet info
         pet = db.fetchone(
-            "SELECT name, type, happiness, xp, health, lvl "
+            f"SELECT name, type, {pet_vitals_sql()}, xp, lvl "
             "FROM pets "
             "WHERE user_id = %s",
             (user["id"],)
@@ -268,13 +873,6 @@ def get_profile():
             (user["id"],)
         )
 
-        # Get accurate habit completion count
-        habits = db.fetchall(
-            "SELECT last_completed_at FROM habits WHERE user_id = %s",
-            (user["id"],)
-        )
-        total_completed = sum(1 for habit in habits if habit["last_completed_at"] is not None)
-
         # Build the response
         profile_data = {
             "user": {
@@ -287,7 +885,7 @@ def get_profile():
             "stats": {
                 "current_streak": stats["current_streak"] if stats else 0,
                 "longest_streak": stats["longest_streak"] if stats else 0,
-                "total_habits_completed": total_completed,
+                "total_habits_completed": stats["total_habits_completed"] if stats else 0,
                 "lifetime_habits_completed": stats["lifetime_habits_completed"] if stats else 0
             },
             "pet": pet if pet else None,
@@ -310,8 +908,6 @@ def get_profile():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/profile/update", methods=["POST"])
 def update_profile():
@@ -339,8 +935,18 @@ def update_profile():
             "message": "Invalid favorite pet type."
         }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
+        # Account fields live on the users table and are part of the cached session
+        user_fields = [field for field in ("display_name", "avatar_url", "timezone") if field in data]
+        if user_fields:
+            db.execute(
+                f"UPDATE users SET {', '.join(f'{field} = %s' for field in user_fields)} WHERE id = %s",
+                [data[field] for field in user_fields] + [user["id"]]
+            )
+            invalidate_user_sessions(user["id"])
+            user.update({field: data[field] for field in user_fields})
+
         # First, check if a record exists
         existing = db.fetchone(
             "SELECT 1 FROM user_descriptions WHERE user_id = %s",
@@ -401,10 +1007,15 @@ def update_profile():
                 
                 db.execute(query, params)
 
-        return jsonify({
+        response = jsonify({
             "status": "ok",
             "message": "Profile updated successfully."
-        }), 200
+        })
+        if user_fields and SESSION_MODE == "signed" and SessionTokens.looks_signed(session_cookie):
+            # Signed tokens carry the account fields, so hand out one with the new values
+            token, expires_at = issue_signed_session(user, current_session_generation(user["id"]))
+            response.set_cookie("session", token, secure=True, httponly=True, samesite="None", expires=expires_at)
+        return response, 200
 
     except Exception as e:
         print(f"Error updating profile: {str(e)}")  # Add debug logging
@@ -412,8 +1023,6 @@ def update_profile():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/has-pet", methods=["GET"])
 def has_pet():
@@ -427,7 +1036,7 @@ def has_pet():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         pet = db.fetchone(
             "SELECT id FROM pets WHERE user_id = %s",
@@ -443,8 +1052,6 @@ def has_pet():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/create-pet", methods=["POST"])
@@ -479,7 +1086,7 @@ def create_pet():
             "message": f"Invalid pet type. Must be one of: {', '.join(valid_pet_types)}"
         }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Check if user already has a pet
         existing_pet = db.fetchone(
@@ -508,7 +1115,7 @@ def create_pet():
 
         # Fetch the created pet
         pet = db.fetchone(
-            "SELECT name, type, happiness, xp, health, lvl FROM pets WHERE user_id = %s",
+            f"SELECT name, type, {pet_vitals_sql()}, xp, lvl FROM pets WHERE user_id = %s",
             (user["id"],)
         )
 
@@ -523,8 +1130,6 @@ def create_pet():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/has-location", methods=["GET"])
@@ -539,7 +1144,7 @@ def has_location():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Check if the user has a geolocation entry
         location = db.fetchone(
@@ -556,8 +1161,6 @@ def has_location():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/set-location", methods=["POST"])
@@ -584,7 +1187,7 @@ def set_location():
     longitude = data["longitude"]
     accuracy = data.get("accuracy", None)
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Insert or update the user's geolocation
         db.execute(
@@ -610,8 +1213,6 @@ def set_location():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/set-bio", methods=["POST"])
 def set_bio():
@@ -634,7 +1235,7 @@ def set_bio():
 
     bio = data["bio"]
 
-    db = create_database_connection()
+    db = get_db()
     try:
         db.execute(
             """
@@ -657,62 +1258,78 @@ def set_bio():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
+
+# Joins the weather prefetched for a geolocation's grid cell as w (alias the geolocation g).
+# Takes %(cell_size)s and %(weather_ttl)s parameters; w.fetched_at > NOW() - %(weather_ttl)s means fresh.
+PREFETCHED_WEATHER_JOIN = """
+    LEFT JOIN weather_cells w
+        ON w.cell_size = %(cell_size)s
+        AND w.cell_row = FLOOR(g.latitude / %(cell_size)s)
+        AND w.cell_col = FLOOR(g.longitude / %(cell_size)s)
+"""
+
+# "prefetched" serves only what `flask prefetch-weather` stored in weather_cells: a stale
+# cell is served as it is and a missing one gets the fallback weather until the next run.
+# "on-demand" also asks Open-Meteo during the request when the cell is missing or stale,
+# for deployments that do not run the prefetch job on a schedule.
+WEATHER_SOURCE = os.environ.get("WEATHER_SOURCE", "prefetched")
+
+weather_client = WeatherClient(
+    base_url=os.environ.get("OPEN_METEO_URL", OPEN_METEO_URL),
+    cell_degrees=float(os.environ.get("WEATHER_CELL_DEGREES", 0.1)),
+    ttl=float(os.environ.get("WEATHER_CACHE_TTL", 900)),
+    stale_ttl=float(os.environ.get("WEATHER_CACHE_STALE_TTL", 6 * 3600)),
+    latency_budget=float(os.environ.get("WEATHER_LATENCY_BUDGET", 2)),
+    breaker=CircuitBreaker(
+        failure_ratio=float(os.environ.get("WEATHER_BREAKER_FAILURE_RATIO", 0.5)),
+        min_calls=int(os.environ.get("WEATHER_BREAKER_MIN_CALLS", 10)),
+        open_seconds=float(os.environ.get("WEATHER_BREAKER_OPEN_SECONDS", 30))
+    )
+)
 
 @app.route("/api/weather", methods=["GET"])
 def get_weather():
     """
     Retrieves the current weather based on the user's geolocation.
     Requires a valid session cookie and a geolocation entry in the database.
+    Serves the weather prefetched for the user's grid cell; only asks
+    Open-Meteo when that is missing or out of date and WEATHER_SOURCE is "on-demand".
     """
-    import requests
-    def _get_weather_str_from_code(code: int):
-        if code >= 0 and code <= 3:
-            return "sunny"
-        elif code == 45 or code == 48:
-            return "cloudy"
-        elif code >= 95 and code <= 99:
-            return "thunder"
-        elif (code >= 51 and code <= 67) or (code >= 80 and code <= 82):
-            return "rainy"
-        elif code >= 71 and code <= 77:
-            return "snowy"
-        else:
-            return "windy"
-
-    def _get_weather_data_for_coordinate(longitude: int, latitude: int):
-            url = f"https://api.open-meteo.com/v1/forecast?longitude={str(longitude)}&latitude={str(latitude)}&&current=weather_code"
-            print(url)
-            response = requests.get(url)
-            if response.status_code == 200:
-                response_data = response.json()
-                print(response_data)
-                return _get_weather_str_from_code(response_data["current"]["weather_code"])
-            else:
-                raise Exception(f"Failed to fetch weather data: {response.status_code}")
-
     session_cookie = request.cookies.get("session")
     error_response, status_code, user = cookie_check(session_cookie)
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
+        # The user's location together with the weather prefetched for its grid cell
         location = db.fetchone(
-            "SELECT latitude, longitude FROM user_geolocations WHERE user_id = %s",
-            (user["id"],)
+            f"""
+            SELECT g.latitude, g.longitude, w.weather,
+                w.fetched_at > NOW() - make_interval(secs => %(weather_ttl)s) AS fresh
+            FROM user_geolocations g
+            {PREFETCHED_WEATHER_JOIN}
+            WHERE g.user_id = %(user_id)s
+            """,
+            {"weather_ttl": weather_client.cache.ttl, "cell_size": weather_client.cell_degrees, "user_id": user["id"]}
         )
         if not location:
             return jsonify({
                 "status": "error",
                 "message": "No geolocation data found for the user."
             }), 404
+        if location["fresh"] or WEATHER_SOURCE != "on-demand":
+            return jsonify({
+                "status": "ok",
+                "weather": location["weather"] or weather_client.fallback
+            }), 200
 
         latitude = location["latitude"]
         longitude = location["longitude"]
+        # Nothing else to read, so don't hold a pooled connection while waiting on upstream
+        release_request_db()
         try:
-            weather = _get_weather_data_for_coordinate(longitude, latitude)
+            weather = weather_client.current(latitude, longitude, last_known=location["weather"])
             return jsonify({
                 "status": "ok",
                 "weather": weather
@@ -728,40 +1345,64 @@ def get_weather():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
+
+# Pet happiness and health decay lazily: the stored values are as of vitals_updated_at
+# and drop by their decay rate once for every whole interval elapsed since then.
+PET_DECAY_INTERVAL_SECONDS = 3600
+
+def pet_decay_ticks_sql(alias="pets"):
+    """
+    SQL expression for the number of whole decay intervals since the pet's vitals were stored.
+    """
+    return f"FLOOR(EXTRACT(EPOCH FROM (NOW() - {alias}.vitals_updated_at)) / {PET_DECAY_INTERVAL_SECONDS})"
+
+def pet_vitals_sql(alias="pets"):
+    """
+    SQL select list computing a pet's current happiness and health in closed form.
+    """
+    ticks = pet_decay_ticks_sql(alias)
+    return (
+        f"GREATEST(0, {alias}.happiness - {alias}.happiness_decay_rate * {ticks})::int AS happiness, "
+        f"GREATEST(0, {alias}.health - {alias}.health_decay_rate * {ticks})::int AS health"
+    )
 
 def check_and_reset_streak(db, user_id):
     """Check if user has completed any habits today and reset streak if not."""
     try:
-        # Get user's last completion time
-        stats = db.fetchone(
-            "SELECT last_completed_at FROM user_stats WHERE user_id = %s",
-            (user_id,)
-        )
+        # Savepoint keeps a failure here from aborting the request's transaction
+        with db.savepoint():
+            # Get user's last completion time
+            stats = db.fetchone(
+                "SELECT last_completed_at FROM user_stats WHERE user_id = %s",
+                (user_id,)
+            )
         
-        if not stats or not stats["last_completed_at"]:
-            return
+            if not stats or not stats["last_completed_at"]:
+                return
             
-        last_completed = stats["last_completed_at"]
-        today = datetime.utcnow().date()
-        last_completed_date = last_completed.date()
+            last_completed = stats["last_completed_at"]
+            today = datetime.utcnow().date()
+            last_completed_date = last_completed.date()
         
-        # Only reset streak if last completion was before yesterday
-        if last_completed_date < today - timedelta(days=1):
-            db.execute(
-                """
-                UPDATE user_stats 
-                SET current_streak = 0,
-                    updated_at = NOW()
-                WHERE user_id = %s
-                """,
-                (user_id,)
-            )
-            print(f"Reset streak for user {user_id} - no completions in last 2 days")
+            # Only reset streak if last completion was before yesterday
+            if last_completed_date < today - timedelta(days=1):
+                db.execute(
+                    """
+                    UPDATE user_stats 
+                    SET current_streak = 0,
+                        updated_at = NOW()
+                    WHERE user_id = %s
+                    """,
+                    (user_id,)
+                )
+                print(f"Reset streak for user {user_id} - no completions in last 2 days")
     except Exception as e:
         print(f"Error checking streak: {str(e)}")
 
+HABITS_LIST_SQL = (
+    "SELECT id, name, recurrence_type AS recurrence, created_at, last_completed_at FROM habits WHERE user_id = %s"
+)
+
 @app.route("/api/habits", methods=["GET"])
 def get_habits():
     session_cookie = request.cookies.get("session")
@@ -769,15 +1410,12 @@ def get_habits():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Check and reset streak if needed
         check_and_reset_streak(db, user["id"])
         
-        habits = db.fetchall(
-            "SELECT id, name, recurrence_type AS recurrence, created_at, last_completed_at FROM habits WHERE user_id = %s",
-            (user["id"],)
-        )
+        habits = db.fetchall(HABITS_LIST_SQL, (user["id"],))
 
         # Optionally mark completion based on whether `last_completed_at` is today
         today = datetime.utcnow().date()
@@ -787,8 +1425,6 @@ def get_habits():
         return jsonify(habits), 200
     except Exception as e:
         return jsonify({ "status": "error", "message": str(e) }), 500
-    finally:
-        db.close()
 
 
 @app.route("/api/habits", methods=["POST"])
@@ -805,7 +1441,7 @@ def create_habit():
     if not name or not recurrence:
         return jsonify({ "status": "error", "message": "Missing name or recurrence" }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         db.execute(
             "INSERT INTO habits (user_id, name, recurrence_type) VALUES (%s, %s, %s)",
@@ -814,8 +1450,6 @@ def create_habit():
         return jsonify({ "status": "ok", "message": "Habit created" }), 201
     except Exception as e:
         return jsonify({ "status": "error", "message": str(e) }), 500
-    finally:
-        db.close()
 
 
 def create_notification(db, user_id, type, message):
@@ -833,105 +1467,57 @@ def create_notification(db, user_id, type, message):
         print(f"Error creating notification: {str(e)}")
         raise e  # Re-raise the exception so it can be handled by the caller
 
-def check_achievements(db, user_id):
-    """Check and unlock achievements for a user based on their stats."""
+achievement_catalog = AchievementCatalog(
+    serialize=app.json.dumps,
+    check_interval=float(os.environ.get("ACHIEVEMENT_CATALOG_CHECK_INTERVAL", 10))
+)
+
+def achievements_response(db, user_id):
+    """
+    Builds the achievements list response from the cached, pre-serialized
+    catalog, flagging the ones the user has unlocked.
+    """
+    catalog = achievement_catalog.get(db)
+    unlocked = db.fetchall(
+        "SELECT achievement_id FROM user_achievements WHERE user_id = %s",
+        (user_id,)
+    )
+    unlocked_ids = {row["achievement_id"] for row in unlocked}
+    return app.response_class(
+        f'{{"achievements":{catalog.to_json(unlocked_ids)},"status":"ok"}}\n',
+        mimetype="application/json"
+    )
+
+def check_achievements(db, user_id, metrics=None):
+    """
+    Check and unlock achievements for a user based on their stats.
+    Callers that know which metrics changed pass them as
+    {condition_type: (old value, new value)} so only the thresholds crossed in
+    between are evaluated; otherwise every metric is loaded and checked in full.
+    """
     try:
-        # Get accurate habit completion count
-        habits = db.fetchall(
-            "SELECT name, last_completed_at FROM habits WHERE user_id = %s",
-            (user_id,)
-        )
-        print(f"Found {len(habits)} habits for user {user_id}")
-        for habit in habits:
-            print(f"Habit: {habit['name']}, Last completed: {habit['last_completed_at']}")
-        
-        total_completed = sum(1 for habit in habits if habit["last_completed_at"] is not None)
-        print(f"Total completed habits: {total_completed}")
-        
-        # Update user stats with accurate count
-        db.execute(
-            """
-            UPDATE user_stats 
-            SET total_habits_completed = %s,
-                updated_at = NOW()
-            WHERE user_id = %s
-            """,
-            (total_completed, user_id)
-        )
-        print(f"Updated user_stats with total_completed = {total_completed}")
-        
-        # Get updated user stats
-        stats = db.fetchone(
-            """
-            SELECT 
-                current_streak,
-                longest_streak,
-                total_habits_completed
-            FROM user_stats
-            WHERE user_id = %s
-            """,
-            (user_id,)
-        )
-        print(f"Updated stats: {stats}")
-        
-        # Get pet level
-        pet = db.fetchone(
-            "SELECT lvl FROM pets WHERE user_id = %s",
-            (user_id,)
-        )
-        print(f"Pet level: {pet['lvl'] if pet else 'No pet'}")
-        
-        # Get all achievements
-        achievements = db.fetchall("SELECT * FROM achievements")
-        print(f"Found {len(achievements)} total achievements")
-        
-        # Get user's unlocked achievements
-        unlocked = db.fetchall(
-            "SELECT achievement_id FROM user_achievements WHERE user_id = %s",
-            (user_id,)
-        )
-        unlocked_ids = {row["achievement_id"] for row in unlocked}
-        print(f"User has {len(unlocked_ids)} unlocked achievements")
-        
-        for achievement in achievements:
-            # Check if user already has this achievement
-            existing = db.fetchone(
-                "SELECT 1 FROM user_achievements WHERE user_id = %s AND achievement_id = %s",
-                (user_id, achievement["id"])
+        if metrics is None:
+            # Get user stats and pet level
+            row = db.fetchone(
+                """
+                SELECT us.current_streak, us.total_habits_completed, p.lvl
+                FROM users u
+                LEFT JOIN user_stats us ON us.user_id = u.id
+                LEFT JOIN pets p ON p.user_id = u.id
+                WHERE u.id = %s
+                """,
+                (user_id,)
             )
-            
-            if not existing:
-                # Check if achievement condition is met
-                should_unlock = False
-                current_value = 0
-                
-                if achievement["condition_type"] == "streak" and stats:
-                    current_value = stats["current_streak"]
-                    should_unlock = current_value >= achievement["condition_value"]
-                    print(f"Checking streak achievement {achievement['name']}: current={current_value}, required={achievement['condition_value']}")
-                elif achievement["condition_type"] == "habits_completed":
-                    current_value = total_completed
-                    should_unlock = current_value >= achievement["condition_value"]
-                    print(f"Checking habits achievement {achievement['name']}: current={current_value}, required={achievement['condition_value']}")
-                elif achievement["condition_type"] == "pet_level" and pet:
-                    current_value = pet["lvl"]
-                    should_unlock = current_value >= achievement["condition_value"]
-                    print(f"Checking pet achievement {achievement['name']}: current={current_value}, required={achievement['condition_value']}")
-                
-                if should_unlock:
-                    print(f"Unlocking achievement: {achievement['name']} (current value: {current_value})")
-                    # Unlock achievement
-                    db.execute(
-                        "INSERT INTO user_achievements (user_id, achievement_id) VALUES (%s, %s)",
-                        (user_id, achievement["id"])
-                    )
-                    # Create notification
-                    create_notification(
-                        db,
-                        user_id,
-                        "achievement",
-                        f"Achievement Unlocked: {achievement['name']} - {achievement['description']} {achievement['icon']}"
-                    )
+            metrics = {
+                "streak": (None, row["current_streak"] if row else None),
+                "habits_completed": (None, row["total_habits_completed"] or 0 if row else 0),
+                "pet_level": (None, row["lvl"] if row else None)
+            }
+        print(f"Checking achievements for user {user_id}: {metrics}")
+
+        reached = achievement_catalog.rules(db).reached(metrics)
+        for message in unlock_achievements(db, user_id, reached):
+            print(f"Unlocked: {message}")
     except Exception as e:
         print(f"Error in check_achievements: {str(e)}")
         raise e
@@ -951,13 +1537,13 @@ def complete_habit():
         }), 400
 
     habit_id = data["habit_id"]
-    db = create_database_connection()
+    db = get_db()
     try:
         print(f"Starting habit completion for user {user['id']}, habit {habit_id}")
         
-        # Get habit
+        # Get habit, locked so concurrent completions see each other's last_completed_at
         habit = db.fetchone(
-            "SELECT * FROM habits WHERE id = %s AND user_id = %s",
+            "SELECT * FROM habits WHERE id = %s AND user_id = %s FOR UPDATE",
             (habit_id, user["id"])
         )
         if not habit:
@@ -983,13 +1569,18 @@ def complete_habit():
 
         print(f"Found pet: {pet['name']} (ID: {pet['id']})")
 
-        # Update habit last completed
+        # Log the completion and update habit last completed
         try:
             db.execute(
-                "UPDATE habits SET last_completed_at = NOW() WHERE id = %s",
-                (habit_id,)
+                """
+                WITH completion AS (
+                    INSERT INTO habit_completions (habit_id, user_id) VALUES (%s, %s)
+                )
+                UPDATE habits SET last_completed_at = NOW() WHERE id = %s
+                """,
+                (habit_id, user["id"], habit_id)
             )
-            print(f"Updated habit last_completed_at to NOW()")
+            print(f"Logged completion and updated habit last_completed_at to NOW()")
         except Exception as e:
             print(f"Error updating habit: {str(e)}")
             raise
@@ -1048,20 +1639,26 @@ def complete_habit():
                 # First completion ever, start streak at 1
                 new_streak = 1
             
-            # Update stats
-            db.execute(
+            # Update stats; total_habits_completed counts habits completed at least once
+            first_completion = 1 if habit["last_completed_at"] is None else 0
+            updated_stats = db.fetchone(
                 """
-                UPDATE user_stats 
+                INSERT INTO user_stats (
+                    user_id, current_streak, longest_streak,
+                    total_habits_completed, lifetime_habits_completed, last_completed_at
+                )
+                VALUES (%s, %s, GREATEST(%s, %s), %s, 1, NOW())
+                ON CONFLICT (user_id) DO UPDATE
                 SET 
-                    current_streak = %s,
-                    longest_streak = GREATEST(%s, %s),
-                    total_habits_completed = total_habits_completed + 1,
-                    lifetime_habits_completed = lifetime_habits_completed + 1,
+                    current_streak = EXCLUDED.current_streak,
+                    longest_streak = EXCLUDED.longest_streak,
+                    total_habits_completed = user_stats.total_habits_completed + EXCLUDED.total_habits_completed,
+                    lifetime_habits_completed = user_stats.lifetime_habits_completed + 1,
                     last_completed_at = NOW(),
                     updated_at = NOW()
-                WHERE user_id = %s
+                RETURNING total_habits_completed
                 """,
-                (new_streak, longest_streak, new_streak, user["id"])
+                (user["id"], new_streak, longest_streak, new_streak, first_completion)
             )
             print(f"Updated user stats with new streak: {new_streak}")
         except Exception as e:
@@ -1081,9 +1678,19 @@ def complete_habit():
             print(f"Error creating notification: {str(e)}")
             raise
 
-        # Check for achievements
+        # Check for achievements, only against the thresholds this completion crossed
         try:
-            check_achievements(db, user["id"])
+            changes = {
+                "streak": (current_streak, new_streak),
+                "habits_completed": (
+                    updated_stats["total_habits_completed"] - first_completion,
+                    updated_stats["total_habits_completed"]
+                ),
+                "pet_level": (pet["lvl"], new_level)
+            }
+            check_achievements(db, user["id"], {
+                condition_type: (old, new) for condition_type, (old, new) in changes.items() if new != old
+            })
             print("Checked achievements")
         except Exception as e:
             print(f"Error checking achievements: {str(e)}")
@@ -1100,8 +1707,6 @@ def complete_habit():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/habits/<uuid:habit_id>", methods=["DELETE"])
 def delete_habit(habit_id):
@@ -1110,14 +1715,25 @@ def delete_habit(habit_id):
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
-        db.execute("DELETE FROM habits WHERE id = %s AND user_id = %s", (str(habit_id), user["id"]))
+        # Keep the completed-habits counter in step when a completed habit goes away
+        db.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM habits WHERE id = %s AND user_id = %s RETURNING last_completed_at
+            )
+            UPDATE user_stats
+            SET total_habits_completed = GREATEST(total_habits_completed - 1, 0),
+                updated_at = NOW()
+            WHERE user_id = %s
+            AND EXISTS (SELECT 1 FROM deleted WHERE last_completed_at IS NOT NULL)
+            """,
+            (str(habit_id), user["id"], user["id"])
+        )
         return jsonify({ "status": "ok", "message": "Habit deleted" }), 200
     except Exception as e:
         return jsonify({ "status": "error", "message": str(e) }), 500
-    finally:
-        db.close()
 
 @app.route("/api/habits/<uuid:habit_id>", methods=["PUT"])
 def update_habit(habit_id):
@@ -1133,7 +1749,7 @@ def update_habit(habit_id):
     if not new_name:
         return jsonify({ "status": "error", "message": "Missing habit name" }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         db.execute(
             "UPDATE habits SET name = %s, recurrence_type = %s WHERE id = %s AND user_id = %s",
@@ -1142,38 +1758,149 @@ def update_habit(habit_id):
         return jsonify({ "status": "ok", "message": "Habit updated" }), 200
     except Exception as e:
         return jsonify({ "status": "error", "message": str(e) }), 500
-    finally:
-        db.close()
+
+# One LISTEN connection per worker shared by every open notification stream
+notification_hub = NotificationHub(
+    queue_size=int(os.environ.get("NOTIFICATION_STREAM_QUEUE_SIZE", 100)),
+    **database_settings()
+)
+NOTIFICATION_STREAM_HEARTBEAT = float(os.environ.get("NOTIFICATION_STREAM_HEARTBEAT", 15))
+
+@app.route("/api/notifications/stream", methods=["GET"])
+def notification_stream():
+    """
+    Server-Sent Events stream of the user's notification changes.
+    Sends an "unread" event with the current unread count first, then a
+    "notification" event (created/updated/deleted) for every change, carrying
+    the unread count after that change, and a
+    "resync" event whenever events may have been missed and the client should
+    reload. Open streams hold no pooled database connection.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    user_id = str(user["id"])
+    # subscribe() returns once the LISTEN is active (or, if that is slow, queues a
+    # resync for when it is), so no change between subscribing and counting is missed
+    subscription = notification_hub.subscribe(user_id)
+    db = get_db()
+    try:
+        counter = db.fetchone(
+            "SELECT unread FROM notification_counters WHERE user_id = %s",
+            (user_id,)
+        )
+        unread = counter["unread"] if counter else 0
+        release_request_db()
+    except Exception as e:
+        notification_hub.unsubscribe(user_id, subscription)
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    def events():
+        yield f"event: unread\ndata: {app.json.dumps({'count': unread})}\n\n"
+        while True:
+            try:
+                payload = subscription.get(timeout=NOTIFICATION_STREAM_HEARTBEAT)
+            except queue.Empty:
+                # Keeps proxies from closing the idle connection and detects gone clients
+                yield ": heartbeat\n\n"
+                continue
+            if payload is NotificationHub.RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                yield f"event: notification\ndata: {payload}\n\n"
+
+    response = app.response_class(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Runs when the server closes the response, even if streaming never started
+    response.call_on_close(lambda: notification_hub.unsubscribe(user_id, subscription))
+    return response
+
+NOTIFICATION_TYPES = ("habit", "pet", "friend", "achievement")
+NOTIFICATIONS_PAGE_SIZE = 50
+NOTIFICATIONS_MAX_PAGE_SIZE = 200
+
+def notifications_page_sql(conditions):
+    return f"""
+        SELECT id, type, message, read, created_at
+        FROM notifications
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    """
 
 @app.route("/api/notifications", methods=["GET"])
 def get_notifications():
+    """
+    Returns a page of the user's notifications, newest first, optionally
+    filtered by ?type=. Pages hold ?limit= notifications (50 by default, at
+    most 200); pass the returned next_cursor as ?before= for the next page.
+    """
     session_cookie = request.cookies.get("session")
     error_response, status_code, user = cookie_check(session_cookie)
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
     try:
-        notifications = db.fetchall(
-            """
-            SELECT id, type, message, read, created_at
-            FROM notifications
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            """,
-            (user["id"],)
-        )
+        limit = max(1, min(int(request.args.get("limit", NOTIFICATIONS_PAGE_SIZE)), NOTIFICATIONS_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit must be an integer."
+        }), 400
+    notification_type = request.args.get("type")
+    if notification_type is not None and notification_type not in NOTIFICATION_TYPES:
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid notification type. Must be one of: {', '.join(NOTIFICATION_TYPES)}"
+        }), 400
+
+    conditions = ["user_id = %(user_id)s"]
+    params = {"user_id": user["id"], "limit": limit + 1}
+    if notification_type:
+        conditions.append("type = %(type)s")
+        params["type"] = notification_type
+    if request.args.get("before"):
+        # The cursor is the created_at and id of the last notification on the previous page
+        before_at, _, before_id = request.args["before"].rpartition(",")
+        try:
+            params["before_id"] = str(uuid.UUID(before_id))
+            params["before_at"] = datetime.fromisoformat(before_at)
+        except ValueError:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid cursor."
+            }), 400
+        conditions.append("(created_at, id) < (%(before_at)s, %(before_id)s::uuid)")
+
+    db = get_db()
+    try:
+        # Walks the (user_id, created_at DESC, id DESC) index from the cursor
+        notifications = db.fetchall(notifications_page_sql(conditions), params)
+        next_cursor = None
+        if len(notifications) > limit:
+            notifications = notifications[:limit]
+            last = notifications[-1]
+            # UTC with a Z suffix so the cursor needs no URL escaping
+            created_at = last["created_at"].astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+            next_cursor = f"{created_at},{last['id']}"
         return jsonify({
             "status": "ok",
-            "notifications": notifications
+            "notifications": notifications,
+            "next_cursor": next_cursor
         }), 200
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/notifications/<uuid:notification_id>/read", methods=["PUT"])
 def mark_notification_read(notification_id):
@@ -1182,7 +1909,7 @@ def mark_notification_read(notification_id):
     if error_response:
         return error_response, status_code
     
-    db = create_database_connection()
+    db = get_db()
     try:
         # Convert UUID to string for database query
         notification_id_str = str(notification_id)
@@ -1205,8 +1932,6 @@ def mark_notification_read(notification_id):
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/notifications/<uuid:notification_id>", methods=["DELETE"])
 def delete_notification(notification_id):
@@ -1215,7 +1940,7 @@ def delete_notification(notification_id):
     if error_response:
         return error_response, status_code
     
-    db = create_database_connection()
+    db = get_db()
     try:
         # Convert UUID to string for database query
         notification_id_str = str(notification_id)
@@ -1237,8 +1962,145 @@ def delete_notification(notification_id):
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
+
+NOTIFICATIONS_BULK_MAX_IDS = 1000
+
+def notification_selector(data, user_id):
+    """
+    Turns a bulk request body into SQL conditions on the user's notifications.
+    The body selects notifications by "ids", "type" and/or "older_than"
+    (combined with AND), or everything with "all": true. Raises ValueError for
+    invalid or missing selectors.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("A JSON body is required.")
+    # Ownership is always enforced, whatever else is selected
+    conditions = ["user_id = %(user_id)s"]
+    params = {"user_id": user_id}
+    if "ids" in data:
+        ids = data["ids"]
+        if not isinstance(ids, list) or not ids or len(ids) > NOTIFICATIONS_BULK_MAX_IDS:
+            raise ValueError(f"'ids' must be a list of 1 to {NOTIFICATIONS_BULK_MAX_IDS} notification ids.")
+        try:
+            params["ids"] = [str(uuid.UUID(str(notification_id))) for notification_id in ids]
+        except ValueError:
+            raise ValueError("Invalid notification id.")
+        conditions.append("id = ANY(%(ids)s::uuid[])")
+    if "type" in data:
+        if data["type"] not in NOTIFICATION_TYPES:
+            raise ValueError(f"Invalid notification type. Must be one of: {', '.join(NOTIFICATION_TYPES)}")
+        params["type"] = data["type"]
+        conditions.append("type = %(type)s")
+    if "older_than" in data:
+        try:
+            params["older_than"] = datetime.fromisoformat(str(data["older_than"]))
+        except ValueError:
+            raise ValueError("'older_than' must be an ISO 8601 timestamp.")
+        conditions.append("created_at < %(older_than)s")
+    if len(conditions) == 1 and data.get("all") is not True:
+        raise ValueError("Select notifications with 'ids', 'type', 'older_than' or 'all': true.")
+    return conditions, params
+
+def mark_notifications_read_sql(conditions):
+    return f"UPDATE notifications SET read = TRUE WHERE {' AND '.join(conditions)} AND read = FALSE RETURNING id"
+
+def mark_notifications_read(db, conditions, params):
+    """
+    Marks the selected unread notifications as read. Returns the ids changed.
+    """
+    rows = db.fetchall(mark_notifications_read_sql(conditions), params)
+    return [row["id"] for row in rows]
+
+@app.route("/api/notifications/mark-read", methods=["POST"])
+def bulk_mark_notifications_read():
+    """
+    Marks the notifications selected by ids, type, older_than or all as read in one statement.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    try:
+        conditions, params = notification_selector(request.get_json(silent=True), user["id"])
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    db = get_db()
+    try:
+        ids = mark_notifications_read(db, conditions, params)
+        return jsonify({
+            "status": "ok",
+            "ids": ids,
+            "count": len(ids)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route("/api/notifications/read-all", methods=["PUT"])
+def mark_all_notifications_read():
+    """
+    Marks every unread notification of the user as read in one statement.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    db = get_db()
+    try:
+        ids = mark_notifications_read(db, *notification_selector({"all": True}, user["id"]))
+        return jsonify({
+            "status": "ok",
+            "ids": ids,
+            "count": len(ids)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route("/api/notifications/delete", methods=["POST"])
+def bulk_delete_notifications():
+    """
+    Deletes the notifications selected by ids, type, older_than or all in one statement.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    try:
+        conditions, params = notification_selector(request.get_json(silent=True), user["id"])
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+
+    db = get_db()
+    try:
+        rows = db.fetchall(
+            f"DELETE FROM notifications WHERE {' AND '.join(conditions)} RETURNING id",
+            params
+        )
+        return jsonify({
+            "status": "ok",
+            "ids": [row["id"] for row in rows],
+            "count": len(rows)
+        }), 200
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
 
 @app.route("/api/notifications/unread-count", methods=["GET"])
 def get_unread_notification_count():
@@ -1247,27 +2109,54 @@ def get_unread_notification_count():
     if error_response:
         return error_response, status_code
     
-    db = create_database_connection()
+    db = get_db()
     try:
         count = db.fetchone(
-            """
-            SELECT COUNT(*) as count
-            FROM notifications
-            WHERE user_id = %s AND read = FALSE
-            """,
+            "SELECT unread FROM notification_counters WHERE user_id = %s",
             (user["id"],)
         )
         return jsonify({
             "status": "ok",
-            "count": count["count"]
+            "count": count["unread"] if count else 0
         }), 200
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
+
+FRIENDS_LIST_SQL = """
+    SELECT
+        u.id,
+        u.display_name AS username,
+        u.avatar_url,
+        p.name AS pet_name,
+        p.type AS pet_type,
+        p.lvl AS pet_level,
+        us.current_streak,
+        -- Add more fields as needed
+        u.email
+    FROM friends f
+    JOIN users u ON u.id = f.friend_id
+    LEFT JOIN pets p ON p.user_id = u.id
+    LEFT JOIN user_stats us ON us.user_id = u.id
+    WHERE f.user_id = %s
+    UNION
+    SELECT
+        u.id,
+        u.display_name AS username,
+        u.avatar_url,
+        p.name AS pet_name,
+        p.type AS pet_type,
+        p.lvl AS pet_level,
+        us.current_streak,
+        u.email
+    FROM friends f
+    JOIN users u ON u.id = f.user_id
+    LEFT JOIN pets p ON p.user_id = u.id
+    LEFT JOIN user_stats us ON us.user_id = u.id
+    WHERE f.friend_id = %s
+"""
 
 @app.route("/api/friends/list", methods=["GET"])
 def get_friends_list():
@@ -1276,44 +2165,10 @@ def get_friends_list():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get all friends
-        friends = db.fetchall(
-            """
-            SELECT
-                u.id,
-                u.display_name AS username,
-                u.avatar_url,
-                p.name AS pet_name,
-                p.type AS pet_type,
-                p.lvl AS pet_level,
-                us.current_streak,
-                -- Add more fields as needed
-                u.email
-            FROM friends f
-            JOIN users u ON u.id = f.friend_id
-            LEFT JOIN pets p ON p.user_id = u.id
-            LEFT JOIN user_stats us ON us.user_id = u.id
-            WHERE f.user_id = %s
-            UNION
-            SELECT
-                u.id,
-                u.display_name AS username,
-                u.avatar_url,
-                p.name AS pet_name,
-                p.type AS pet_type,
-                p.lvl AS pet_level,
-                us.current_streak,
-                u.email
-            FROM friends f
-            JOIN users u ON u.id = f.user_id
-            LEFT JOIN pets p ON p.user_id = u.id
-            LEFT JOIN user_stats us ON us.user_id = u.id
-            WHERE f.friend_id = %s
-            """,
-            (user["id"], user["id"])
-        )
+        friends = db.fetchall(FRIENDS_LIST_SQL, (user["id"], user["id"]))
         friends_list = [{
             "id": f["id"],
             "username": f["username"],
@@ -1327,8 +2182,6 @@ def get_friends_list():
         return jsonify(friends_list), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        db.close()
 
 @app.route("/api/friends/request", methods=["POST"])
 def send_friend_request():
@@ -1345,7 +2198,7 @@ def send_friend_request():
         }), 400
 
     friend_id = data["friend_id"]
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get friend's display name
         friend = db.fetchone(
@@ -1399,7 +2252,6 @@ def send_friend_request():
             "friend",
             f"{user['display_name']} sent you a friend request!"
         )
-        db.commit()
 
         return jsonify({
             "status": "ok",
@@ -1410,8 +2262,13 @@ def send_friend_request():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
+
+INCOMING_FRIEND_REQUESTS_SQL = """
+    SELECT fr.id, fr.from_user_id, u.display_name AS username, u.avatar_url
+    FROM friend_requests fr
+    JOIN users u ON fr.from_user_id = u.id
+    WHERE fr.to_user_id = %s AND fr.status = 'pending'
+"""
 
 @app.route("/api/friends/requests", methods=["GET"])
 def get_incoming_friend_requests():
@@ -1420,18 +2277,10 @@ def get_incoming_friend_requests():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Find all pending requests
-        requests = db.fetchall(
-            """
-            SELECT fr.id, fr.from_user_id, u.display_name AS username, u.avatar_url
-            FROM friend_requests fr
-            JOIN users u ON fr.from_user_id = u.id
-            WHERE fr.to_user_id = %s AND fr.status = 'pending'
-            """,
-            (user["id"],)
-        )
+        requests = db.fetchall(INCOMING_FRIEND_REQUESTS_SQL, (user["id"],))
         return jsonify({
             "status": "ok",
             "requests": requests
@@ -1441,8 +2290,6 @@ def get_incoming_friend_requests():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/friends/reject", methods=["POST"])
 def reject_friend_request():
@@ -1455,7 +2302,7 @@ def reject_friend_request():
     if not data or "request_id" not in data:
         return jsonify({"status": "error", "message": "request_id required"}), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Just mark as rejected or delete
         db.execute(
@@ -1465,8 +2312,15 @@ def reject_friend_request():
         return jsonify({"status": "ok"}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        db.close()
+
+SENT_FRIEND_REQUESTS_SQL = """
+    SELECT fr.id, fr.to_user_id, u.display_name AS username, u.avatar_url,
+        fr.created_at, p.name AS pet_name, p.type AS pet_type
+    FROM friend_requests fr
+    JOIN users u ON u.id = fr.to_user_id
+    LEFT JOIN pets p ON p.user_id = fr.to_user_id
+    WHERE fr.from_user_id = %s AND fr.status = 'pending'
+"""
 
 @app.route("/api/friends/sent", methods=["GET"])
 def get_sent_friend_requests():
@@ -1475,20 +2329,10 @@ def get_sent_friend_requests():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get all pending requests sent by this user
-        sent = db.fetchall(
-            """
-            SELECT fr.id, fr.to_user_id, u.display_name AS username, u.avatar_url,
-                fr.created_at, p.name AS pet_name, p.type AS pet_type
-            FROM friend_requests fr
-            JOIN users u ON u.id = fr.to_user_id
-            LEFT JOIN pets p ON p.user_id = fr.to_user_id
-            WHERE fr.from_user_id = %s AND fr.status = 'pending'
-            """,
-            (user["id"],)
-        )
+        sent = db.fetchall(SENT_FRIEND_REQUESTS_SQL, (user["id"],))
         sent_list = [{
             "id": req["id"],
             "username": req["username"],
@@ -1501,75 +2345,54 @@ def get_sent_friend_requests():
         return jsonify(sent_list), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        db.close()
+
+USER_LOOKUP_SQL = "SELECT id, display_name FROM users WHERE email = %s OR display_name = %s"
 
 @app.route("/api/users/lookup", methods=["POST"])
 def lookup_user():
     data = request.get_json()
     query = data.get("query", "")
-    db = create_database_connection()
-    try:
-        user = db.fetchone(
-            "SELECT id, display_name FROM users WHERE email = %s OR display_name = %s",
-            (query, query)
-        )
-        if user:
-            return jsonify({"user": user}), 200
-        else:
-            return jsonify({"message": "User not found"}), 404
-    finally:
-        db.close()
+    db = get_db()
+    user = db.fetchone(USER_LOOKUP_SQL, (query, query))
+    if user:
+        return jsonify({"user": user}), 200
+    else:
+        return jsonify({"message": "User not found"}), 404
 
 @app.route("/api/users/<user_id>", methods=["GET"])
 def get_user_profile(user_id):
-    db = create_database_connection()
-    try:
-        user = db.fetchone("SELECT id, display_name, email FROM users WHERE id = %s", (user_id,))
-        if not user:
-            return jsonify({"message": "User not found"}), 404
-        pet = db.fetchone("SELECT name, type, lvl FROM pets WHERE user_id = %s", (user_id,))
-        profile = db.fetchone("SELECT bio, location, interests, favorite_pet_type FROM user_descriptions WHERE user_id = %s", (user_id,))
-        
-        # Get accurate habit completion count
-        habits = db.fetchall(
-            "SELECT last_completed_at FROM habits WHERE user_id = %s",
-            (user_id,)
-        )
-        total_completed = sum(1 for habit in habits if habit["last_completed_at"] is not None)
-        
-        stats = db.fetchone(
-            "SELECT current_streak, longest_streak FROM user_stats WHERE user_id = %s", 
-            (user_id,)
-        )
+    db = get_db()
+    user = db.fetchone("SELECT id, display_name, email FROM users WHERE id = %s", (user_id,))
+    if not user:
+        return jsonify({"message": "User not found"}), 404
+    pet = db.fetchone("SELECT name, type, lvl FROM pets WHERE user_id = %s", (user_id,))
+    profile = db.fetchone("SELECT bio, location, interests, favorite_pet_type FROM user_descriptions WHERE user_id = %s", (user_id,))
+    stats = db.fetchone(
+        "SELECT current_streak, longest_streak, total_habits_completed, lifetime_habits_completed "
+        "FROM user_stats WHERE user_id = %s",
+        (user_id,)
+    )
+    if not stats:
+        stats = {
+            "current_streak": 0,
+            "longest_streak": 0,
+            "total_habits_completed": 0,
+            "lifetime_habits_completed": 0
+        }
         
-        # Add total_habits_completed to stats
-        if stats:
-            stats["total_habits_completed"] = total_completed
-            stats["lifetime_habits_completed"] = total_completed
-        else:
-            stats = {
-                "current_streak": 0,
-                "longest_streak": 0,
-                "total_habits_completed": total_completed,
-                "lifetime_habits_completed": total_completed
-            }
-            
-        achievements = db.fetchall("""
-            SELECT a.id, a.name, a.description, a.icon, ua.unlocked_at
-            FROM user_achievements ua
-            JOIN achievements a ON ua.achievement_id = a.id
-            WHERE ua.user_id = %s
-        """, (user_id,))
-        return jsonify({
-            "user": user,
-            "pet": pet,
-            "profile": profile,
-            "stats": stats,
-            "achievements": achievements
-        }), 200
-    finally:
-        db.close()
+    achievements = db.fetchall("""
+        SELECT a.id, a.name, a.description, a.icon, ua.unlocked_at
+        FROM user_achievements ua
+        JOIN achievements a ON ua.achievement_id = a.id
+        WHERE ua.user_id = %s
+    """, (user_id,))
+    return jsonify({
+        "user": user,
+        "pet": pet,
+        "profile": profile,
+        "stats": stats,
+        "achievements": achievements
+    }), 200
 
 @app.route("/api/friends/accept", methods=["POST"])
 def accept_friend_request():
@@ -1586,7 +2409,7 @@ def accept_friend_request():
         }), 400
 
     friend_id = data["friend_id"]
-    db = create_database_connection()
+    db = get_db()
     try:
         req = db.fetchone(
             "SELECT id FROM friend_requests WHERE from_user_id = %s AND to_user_id = %s AND status = 'pending'",
@@ -1617,7 +2440,6 @@ def accept_friend_request():
             "friend",
             f"{user['display_name']} accepted your friend request!"
         )
-        db.commit()
 
         return jsonify({
             "status": "ok",
@@ -1628,131 +2450,321 @@ def accept_friend_request():
             "status": "error",
             "message": str(e)
         }), 500
+
+# Ranks in global_leaderboard are recomputed at most this often, in the background
+# once a request finds them stale (or by the refresh-leaderboard job)
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get("LEADERBOARD_REFRESH_SECONDS", 60))
+LEADERBOARD_REFRESH_LOCK = 7_100_001  # pg advisory lock key
+LEADERBOARD_MAX_PAGE_SIZE = 100
+leaderboard_refresh_running = threading.Lock()
+
+def refresh_global_leaderboard():
+    """
+    Recomputes the global_leaderboard ranking on a dedicated connection unless
+    another worker is already doing so. Returns True if this call refreshed it.
+    """
+    db = create_database_connection()
+    try:
+        locked = db.fetchone("SELECT pg_try_advisory_lock(%s) AS locked", (LEADERBOARD_REFRESH_LOCK,))["locked"]
+        db.commit()
+        if not locked:
+            return False
+        try:
+            db.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY global_leaderboard")
+            db.execute("UPDATE leaderboard_refreshes SET refreshed_at = NOW()")
+        finally:
+            db.fetchone("SELECT pg_advisory_unlock(%s)", (LEADERBOARD_REFRESH_LOCK,))
+            db.commit()
+        return True
+    finally:
+        db.close()
+
+def refresh_global_leaderboard_soon():
+    """
+    Starts a refresh of the global ranking on the background executor, unless
+    one is already running in this worker. Callers keep serving the current
+    ranking meanwhile instead of waiting for the refresh.
+    """
+    if not leaderboard_refresh_running.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_global_leaderboard()
+        except Exception as e:
+            print(f"Refreshing the global leaderboard failed: {e}")
+        finally:
+            leaderboard_refresh_running.release()
+
+    try:
+        background_executor.submit(run)
+    except Exception:
+        leaderboard_refresh_running.release()
+        raise
+
+# Whether the ranking in global_leaderboard is older than LEADERBOARD_REFRESH_SECONDS
+LEADERBOARD_STALE_SQL = "(SELECT refreshed_at < NOW() - make_interval(secs => %s) FROM leaderboard_refreshes)"
+
+def leaderboard_entry(row):
+    return {
+        "id": row["id"],
+        "rank": row["rank"],
+        "username": row["username"],
+        "petName": row["pet_name"],
+        "petType": row["pet_type"],
+        "level": row["level"],
+        "streak": row["streak"],
+        "habitsCompleted": row["habits_completed"],
+        "avatar": row["avatar_url"]
+    }
+
+# The global leaderboard is the same for every viewer, so rendered pages are shared
+# between requests and handed to the CDN with the same freshness window
+leaderboard_cache = RefreshingCache(
+    maxsize=int(os.environ.get("LEADERBOARD_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("LEADERBOARD_CACHE_TTL", 15)),
+    stale_ttl=float(os.environ.get("LEADERBOARD_CACHE_STALE_TTL", 60))
+)
+
+def render_global_leaderboard_page(after_rank, limit):
+    """
+    Reads one page of the precomputed global ranking on a dedicated connection
+    (this also runs from background refreshes, outside any request). A stale
+    ranking is still served while a refresh runs in the background.
+    Returns the JSON body and its ETag.
+    """
+    db = create_database_connection()
+    try:
+        meta = db.fetchone(
+            f"""
+            SELECT
+                (SELECT COALESCE(MAX(rank), 0) FROM global_leaderboard) AS total,
+                {LEADERBOARD_STALE_SQL} AS stale
+            """,
+            (LEADERBOARD_REFRESH_SECONDS,)
+        )
+        if meta["stale"]:
+            refresh_global_leaderboard_soon()
+
+        users = db.fetchall(
+            """
+            SELECT rank, user_id AS id, username, pet_name, pet_type, level, streak, habits_completed, avatar_url
+            FROM global_leaderboard
+            WHERE rank > %s
+            ORDER BY rank
+            LIMIT %s
+            """,
+            (after_rank, limit)
+        )
+        db.commit()
     finally:
         db.close()
 
+    users_out = [leaderboard_entry(user) for user in users]
+    next_cursor = users[-1]["rank"] if users and users[-1]["rank"] < meta["total"] else None
+    body = app.json.dumps({"users": users_out, "total": meta["total"], "next_cursor": next_cursor})
+    return body, hashlib.sha256(body.encode()).hexdigest()[:32]
+
 @app.route("/api/leaderboard/global", methods=["GET"])
 def global_leaderboard():
-    page = int(request.args.get("page", 1))
-    limit = int(request.args.get("limit", 20))
-    offset = (page - 1) * limit
+    """
+    Returns a page of the precomputed global ranking, ordered by streak then pet level.
+    Pages are addressed either by ?page=&limit= or by ?after=<rank>&limit=, where
+    after is the next_cursor of the previous page; both read only the requested rows.
+    limit is 20 by default and at most 100.
+    Responses are cached per page and carry Cache-Control and ETag headers.
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), LEADERBOARD_MAX_PAGE_SIZE))
+        if "after" in request.args:
+            after_rank = max(0, int(request.args["after"]))
+        else:
+            after_rank = (max(1, int(request.args.get("page", 1))) - 1) * limit
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit, page and after must be integers."
+        }), 400
 
-    db = create_database_connection()
     try:
+        body, etag = leaderboard_cache.get(
+            (after_rank, limit),
+            lambda: render_global_leaderboard_page(after_rank, limit)
+        )
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    response = app.response_class(body, status=200, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(leaderboard_cache.ttl)
+    response.cache_control.stale_while_revalidate = int(leaderboard_cache.stale_ttl)
+    return response.make_conditional(request)
+
+@app.route("/api/leaderboard/global/me", methods=["GET"])
+def global_leaderboard_me():
+    """
+    Returns the caller's global rank and up to ?neighbors=N users ranked directly above and below.
+    rank is null until the caller appears in the next leaderboard refresh, which
+    is started in the background when the ranking is stale.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    try:
+        neighbors = max(0, min(int(request.args.get("neighbors", 5)), 50))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "neighbors must be an integer."
+        }), 400
+
+    db = get_db()
+    try:
+        if db.fetchone(f"SELECT {LEADERBOARD_STALE_SQL} AS stale", (LEADERBOARD_REFRESH_SECONDS,))["stale"]:
+            refresh_global_leaderboard_soon()
         users = db.fetchall(
             """
-            SELECT
-                u.id,
-                u.display_name AS username,
-                COALESCE(p.name, '') AS pet_name,
-                COALESCE(p.type, '') AS pet_type,
-                COALESCE(p.lvl, 1) AS level,
-                COALESCE(us.current_streak, 0) AS streak,
-                (
-                    SELECT COUNT(*) 
-                    FROM habits h 
-                    WHERE h.user_id = u.id AND h.last_completed_at IS NOT NULL
-                ) AS habits_completed,
-                u.avatar_url
-            FROM users u
-            LEFT JOIN pets p ON p.user_id = u.id
-            LEFT JOIN user_stats us ON us.user_id = u.id
-            ORDER BY streak DESC, level DESC
-            LIMIT %s OFFSET %s
-            """, (limit, offset)
-        )
-        total_count = db.fetchone("SELECT COUNT(*) AS total FROM users")["total"]
-
-        users_out = [{
-            "id": user["id"],
-            "username": user["username"],
-            "petName": user["pet_name"],
-            "petType": user["pet_type"],
-            "level": user["level"],
-            "streak": user["streak"],
-            "habitsCompleted": user["habits_completed"],
-            "avatar": user["avatar_url"]
-        } for user in users]
-
-        return jsonify({"users": users_out, "total": total_count}), 200
+            WITH me AS (
+                SELECT rank FROM global_leaderboard WHERE user_id = %s
+            )
+            SELECT g.rank, g.user_id AS id, g.username, g.pet_name, g.pet_type, g.level, g.streak,
+                g.habits_completed, g.avatar_url,
+                (SELECT COALESCE(MAX(rank), 0) FROM global_leaderboard) AS total
+            FROM me
+            JOIN global_leaderboard g ON g.rank BETWEEN me.rank - %s AND me.rank + %s
+            ORDER BY g.rank
+            """,
+            (user["id"], neighbors, neighbors)
+        )
+        me = next((row for row in users if str(row["id"]) == str(user["id"])), None)
+        return jsonify({
+            "rank": me["rank"] if me else None,
+            "total": users[0]["total"] if users else None,
+            "users": [leaderboard_entry(row) for row in users]
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Ranks the caller and their friends (in either direction of the friends table)
+# the same way as the global leaderboard. Takes a single %(user_id)s parameter.
+FRIENDS_RANKING_CTE = """
+    members AS (
+        SELECT friend_id AS id FROM friends WHERE user_id = %(user_id)s
+        UNION
+        SELECT user_id FROM friends WHERE friend_id = %(user_id)s
+        UNION
+        SELECT %(user_id)s::uuid
+    ),
+    ranked AS (
+        SELECT
+            ROW_NUMBER() OVER (
+                ORDER BY COALESCE(us.current_streak, 0) DESC, COALESCE(p.lvl, 1) DESC, u.id
+            ) AS rank,
+            u.id,
+            u.display_name AS username,
+            COALESCE(p.name, '') AS pet_name,
+            COALESCE(p.type, '') AS pet_type,
+            COALESCE(p.lvl, 1) AS level,
+            COALESCE(us.current_streak, 0) AS streak,
+            COALESCE(us.total_habits_completed, 0) AS habits_completed,
+            u.avatar_url,
+            COUNT(*) OVER () AS total
+        FROM members m
+        JOIN users u ON u.id = m.id
+        LEFT JOIN pets p ON p.user_id = u.id
+        LEFT JOIN user_stats us ON us.user_id = u.id
+    )
+"""
+
+@app.route("/api/leaderboard/friends/me", methods=["GET"])
+def friends_leaderboard_me():
+    """
+    Returns the caller's rank among their friends and up to ?neighbors=N friends ranked directly above and below.
+    """
+    session_cookie = request.cookies.get("session")
+    error_response, status_code, user = cookie_check(session_cookie)
+    if error_response:
+        return error_response, status_code
+
+    try:
+        neighbors = max(0, min(int(request.args.get("neighbors", 5)), 50))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "neighbors must be an integer."
+        }), 400
+
+    db = get_db()
+    try:
+        users = db.fetchall(
+            f"""
+            WITH {FRIENDS_RANKING_CTE},
+            me AS (
+                SELECT rank FROM ranked WHERE id = %(user_id)s
+            )
+            SELECT ranked.*
+            FROM me
+            JOIN ranked ON ranked.rank BETWEEN me.rank - %(neighbors)s AND me.rank + %(neighbors)s
+            ORDER BY ranked.rank
+            """,
+            {"user_id": user["id"], "neighbors": neighbors}
+        )
+        me = next((row for row in users if str(row["id"]) == str(user["id"])), None)
+        return jsonify({
+            "rank": me["rank"] if me else None,
+            "total": me["total"] if me else None,
+            "users": [leaderboard_entry(row) for row in users]
+        }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        db.close()
 
 @app.route("/api/leaderboard/friends", methods=["GET"])
 def friends_leaderboard():
+    """
+    Returns a page of the caller's friends ranking, the caller included.
+    limit is 20 by default and at most 100.
+    """
     session_cookie = request.cookies.get("session")
     error_response, status_code, user = cookie_check(session_cookie)
     if error_response:
         return error_response, status_code
 
-    page = int(request.args.get("page", 1))
-    limit = int(request.args.get("limit", 20))
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), LEADERBOARD_MAX_PAGE_SIZE))
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        return jsonify({
+            "status": "error",
+            "message": "limit and page must be integers."
+        }), 400
     offset = (page - 1) * limit
 
-    db = create_database_connection()
+    db = get_db()
     try:
-        # Get friend IDs
-        friends = db.fetchall(
-            """
-            SELECT friend_id FROM friends WHERE user_id = %s
-            UNION
-            SELECT user_id FROM friends WHERE friend_id = %s
-            """, (user["id"], user["id"])
-        )
-        friend_ids = [str(f["friend_id"]) for f in friends]
-
-        # Include self in leaderboard
-        if str(user["id"]) not in friend_ids:
-            friend_ids.append(str(user["id"]))
-
-        if not friend_ids:
-            return jsonify({"users": [], "total": 0}), 200
-
-        ids_placeholder = ",".join(["%s"] * len(friend_ids))
-
         users = db.fetchall(
             f"""
-            SELECT
-                u.id,
-                u.display_name AS username,
-                COALESCE(p.name, '') AS pet_name,
-                COALESCE(p.type, '') AS pet_type,
-                COALESCE(p.lvl, 1) AS level,
-                COALESCE(us.current_streak, 0) AS streak,
-                (
-                    SELECT COUNT(*) 
-                    FROM habits h 
-                    WHERE h.user_id = u.id AND h.last_completed_at IS NOT NULL
-                ) AS habits_completed,
-                u.avatar_url
-            FROM users u
-            LEFT JOIN pets p ON p.user_id = u.id
-            LEFT JOIN user_stats us ON us.user_id = u.id
-            WHERE u.id IN ({ids_placeholder})
-            ORDER BY streak DESC, level DESC
-            LIMIT %s OFFSET %s
-            """, (*friend_ids, limit, offset)
-        )
-        total_count = len(friend_ids)
-
-        users_out = [{
-            "id": user["id"],
-            "username": user["username"],
-            "petName": user["pet_name"],
-            "petType": user["pet_type"],
-            "level": user["level"],
-            "streak": user["streak"],
-            "habitsCompleted": user["habits_completed"],
-            "avatar": user["avatar_url"]
-        } for user in users]
-
-        return jsonify({"users": users_out, "total": total_count}), 200
+            WITH {FRIENDS_RANKING_CTE}
+            SELECT * FROM ranked
+            ORDER BY rank
+            LIMIT %(limit)s OFFSET %(offset)s
+            """,
+            {"user_id": user["id"], "limit": limit, "offset": offset}
+        )
+        if users:
+            total_count = users[0]["total"]
+        else:
+            # Past the last page the window has no row to report the total on
+            total_count = db.fetchone(
+                f"WITH {FRIENDS_RANKING_CTE} SELECT COUNT(*) AS total FROM members",
+                {"user_id": user["id"]}
+            )["total"]
+
+        return jsonify({"users": [leaderboard_entry(row) for row in users], "total": total_count}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        db.close()
 
 @app.route("/api/pet/update-status", methods=["POST"])
 def update_pet_status():
@@ -1770,7 +2782,7 @@ def update_pet_status():
 
     happiness = data["happiness"]
     health = data["health"]
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get pet info
         pet = db.fetchone(
@@ -1785,7 +2797,7 @@ def update_pet_status():
 
         # Update pet status
         db.execute(
-            "UPDATE pets SET happiness = %s, health = %s WHERE user_id = %s",
+            "UPDATE pets SET happiness = %s, health = %s, vitals_updated_at = NOW() WHERE user_id = %s",
             (happiness, health, user["id"])
         )
 
@@ -1814,8 +2826,6 @@ def update_pet_status():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/pet/level-up", methods=["POST"])
 def pet_level_up():
@@ -1824,7 +2834,7 @@ def pet_level_up():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get pet info
         pet = db.fetchone(
@@ -1853,7 +2863,7 @@ def pet_level_up():
         )
 
         # Check for achievements after level up
-        check_achievements(db, user["id"])
+        check_achievements(db, user["id"], {"pet_level": (pet["lvl"], new_level)})
 
         return jsonify({
             "status": "ok",
@@ -1865,8 +2875,6 @@ def pet_level_up():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements/unlock", methods=["POST"])
 def unlock_achievement():
@@ -1885,7 +2893,7 @@ def unlock_achievement():
     achievement_name = data["name"]
     achievement_description = data["description"]
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Create notification for achievement
         create_notification(
@@ -1904,8 +2912,6 @@ def unlock_achievement():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/friends/message", methods=["POST"])
 def send_friend_message():
@@ -1924,7 +2930,7 @@ def send_friend_message():
     friend_id = data["friend_id"]
     message = data["message"]
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get friend's display name
         friend = db.fetchone(
@@ -1944,7 +2950,6 @@ def send_friend_message():
             "friend",
             f"New message from {user['display_name']}: '{message}'"
         )
-        db.commit()
 
         return jsonify({
             "status": "ok",
@@ -1955,25 +2960,23 @@ def send_friend_message():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/pet/update-time", methods=["POST"])
 def update_pet_time():
     """
-    Updates pet stats based on time passed.
-    This should be called periodically by the frontend.
+    Returns the pet's stats with time-based decay applied.
+    Decay is computed on read, so calling this periodically does not write to the pet.
     """
     session_cookie = request.cookies.get("session")
     error_response, status_code, user = cookie_check(session_cookie)
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
-        # Get current pet stats
+        # Get current pet stats, decayed for the time passed
         pet = db.fetchone(
-            "SELECT name, type, happiness, xp, health, lvl FROM pets WHERE user_id = %s",
+            f"SELECT name, type, {pet_vitals_sql()}, xp, lvl FROM pets WHERE user_id = %s",
             (user["id"],)
         )
         if not pet:
@@ -1982,9 +2985,8 @@ def update_pet_time():
                 "message": "Pet not found."
             }), 404
 
-        # Calculate new stats (decrease over time)
-        new_happiness = max(0, pet["happiness"] - 2)  # Decrease happiness by 2, min 0
-        new_health = max(0, pet["health"] - 1)  # Decrease health by 1, min 0
+        new_happiness = pet["happiness"]
+        new_health = pet["health"]
 
         # Check for recent similar notifications (within last hour)
         recent_notifications = db.fetchall(
@@ -2021,12 +3023,6 @@ def update_pet_time():
                     f"{pet['name']} is not feeling well! Maybe it needs some care? 🐾"
                 )
 
-        # Update pet stats
-        db.execute(
-            "UPDATE pets SET happiness = %s, health = %s WHERE user_id = %s",
-            (new_happiness, new_health, user["id"])
-        )
-
         return jsonify({
             "status": "ok",
             "message": "Pet status updated successfully.",
@@ -2042,8 +3038,6 @@ def update_pet_time():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/settings", methods=["GET"])
 def get_settings():
@@ -2057,7 +3051,7 @@ def get_settings():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get user settings, create default settings if none exist
         settings = db.fetchone(
@@ -2094,8 +3088,6 @@ def get_settings():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/settings", methods=["PUT"])
 def update_settings():
@@ -2135,7 +3127,7 @@ def update_settings():
             "message": f"Invalid setting: {setting}"
         }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Update the setting
         db.execute(
@@ -2168,8 +3160,6 @@ def update_settings():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/account", methods=["DELETE"])
 def delete_account():
@@ -2183,10 +3173,12 @@ def delete_account():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Delete user (this will cascade delete all related data due to ON DELETE CASCADE)
         db.execute("DELETE FROM users WHERE id = %s", (user["id"],))
+        invalidate_user_sessions(user["id"])
+        db.after_commit(lambda: session_generations.set(user["id"], -1))
         
         return jsonify({
             "status": "ok",
@@ -2197,8 +3189,6 @@ def delete_account():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/export-data", methods=["GET"])
 def export_user_data():
@@ -2212,7 +3202,7 @@ def export_user_data():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get user profile data
         profile = db.fetchone(
@@ -2253,13 +3243,12 @@ def export_user_data():
 
         # Get pet data
         pet = db.fetchone(
-            """
+            f"""
             SELECT 
                 name,
                 type,
-                happiness,
+                {pet_vitals_sql()},
                 xp,
-                health,
                 lvl,
                 created_at
             FROM pets
@@ -2370,8 +3359,6 @@ def export_user_data():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements", methods=["GET"])
 def get_achievements():
@@ -2380,33 +3367,14 @@ def get_achievements():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
-        # Get all achievements
-        achievements = db.fetchall("SELECT * FROM achievements ORDER BY condition_value")
-        
-        # Get user's unlocked achievements
-        unlocked = db.fetchall(
-            "SELECT achievement_id FROM user_achievements WHERE user_id = %s",
-            (user["id"],)
-        )
-        unlocked_ids = {row["achievement_id"] for row in unlocked}
-        
-        # Add unlocked status to achievements
-        for achievement in achievements:
-            achievement["unlocked"] = achievement["id"] in unlocked_ids
-        
-        return jsonify({
-            "status": "ok",
-            "achievements": achievements
-        }), 200
+        return achievements_response(db, user["id"]), 200
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements/initialize", methods=["POST"])
 def initialize_achievements():
@@ -2416,7 +3384,7 @@ def initialize_achievements():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Check if achievements already exist
         existing_achievements = db.fetchone("SELECT COUNT(*) as count FROM achievements")
@@ -2572,6 +3540,11 @@ def initialize_achievements():
                         achievement["icon"]
                     )
                 )
+            # Make every worker reload its cached catalog
+            db.execute(
+                "UPDATE achievement_catalog_version SET version = version + 1, updated_at = NOW()"
+            )
+            achievement_catalog.invalidate()
 
         return jsonify({
             "status": "ok",
@@ -2582,8 +3555,6 @@ def initialize_achievements():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements/check", methods=["POST"])
 def check_achievements_endpoint():
@@ -2593,34 +3564,18 @@ def check_achievements_endpoint():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Check achievements
         check_achievements(db, user["id"])
         
         # Get updated achievements
-        achievements = db.fetchall("SELECT * FROM achievements ORDER BY condition_value")
-        unlocked = db.fetchall(
-            "SELECT achievement_id FROM user_achievements WHERE user_id = %s",
-            (user["id"],)
-        )
-        unlocked_ids = {row["achievement_id"] for row in unlocked}
-        
-        # Add unlocked status to achievements
-        for achievement in achievements:
-            achievement["unlocked"] = achievement["id"] in unlocked_ids
-        
-        return jsonify({
-            "status": "ok",
-            "achievements": achievements
-        }), 200
+        return achievements_response(db, user["id"]), 200
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/stats/update", methods=["POST"])
 def update_stats():
@@ -2637,7 +3592,7 @@ def update_stats():
             "message": "Invalid input. 'total_habits_completed' is required."
         }), 400
 
-    db = create_database_connection()
+    db = get_db()
     try:
         db.execute(
             """
@@ -2650,7 +3605,7 @@ def update_stats():
         )
         
         # Check for achievements after updating stats
-        check_achievements(db, user["id"])
+        check_achievements(db, user["id"], {"habits_completed": (None, data["total_habits_completed"])})
         
         return jsonify({
             "status": "ok",
@@ -2661,8 +3616,6 @@ def update_stats():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements/debug", methods=["GET"])
 def debug_achievements():
@@ -2672,7 +3625,7 @@ def debug_achievements():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
         # Get user stats
         stats = db.fetchone(
@@ -2694,7 +3647,7 @@ def debug_achievements():
         )
         
         # Get all achievements
-        achievements = db.fetchall("SELECT * FROM achievements")
+        achievements = [dict(achievement) for achievement in achievement_catalog.get(db).achievements]
         
         # Get user's unlocked achievements
         unlocked = db.fetchall(
@@ -2732,8 +3685,6 @@ def debug_achievements():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/achievements/reset", methods=["POST"])
 def reset_achievements():
@@ -2743,27 +3694,16 @@ def reset_achievements():
     if error_response:
         return error_response, status_code
 
-    db = create_database_connection()
+    db = get_db()
     try:
-        # Get accurate habit completion count
-        habits = db.fetchall(
-            "SELECT name, last_completed_at FROM habits WHERE user_id = %s",
+        # Get habit completion count
+        stats = db.fetchone(
+            "SELECT total_habits_completed FROM user_stats WHERE user_id = %s",
             (user["id"],)
         )
-        total_completed = sum(1 for habit in habits if habit["last_completed_at"] is not None)
+        total_completed = stats["total_habits_completed"] if stats else 0
         print(f"Found {total_completed} completed habits")
 
-        # Update user stats with accurate count
-        db.execute(
-            """
-            UPDATE user_stats 
-            SET total_habits_completed = %s,
-                updated_at = NOW()
-            WHERE user_id = %s
-            """,
-            (total_completed, user["id"])
-        )
-
         # Get pet level
         pet = db.fetchone(
             "SELECT lvl FROM pets WHERE user_id = %s",
@@ -2771,9 +3711,6 @@ def reset_achievements():
         )
         pet_level = pet["lvl"] if pet else 0
 
-        # Get all achievements
-        achievements = db.fetchall("SELECT * FROM achievements")
-        
         # Delete all user achievements
         db.execute(
             "DELETE FROM user_achievements WHERE user_id = %s",
@@ -2781,26 +3718,12 @@ def reset_achievements():
         )
 
         # Re-unlock achievements based on actual stats
-        for achievement in achievements:
-            should_unlock = False
-            
-            if achievement["condition_type"] == "habits_completed" and total_completed >= achievement["condition_value"]:
-                should_unlock = True
-            elif achievement["condition_type"] == "pet_level" and pet_level >= achievement["condition_value"]:
-                should_unlock = True
-            
-            if should_unlock:
-                print(f"Re-unlocking achievement: {achievement['name']}")
-                db.execute(
-                    "INSERT INTO user_achievements (user_id, achievement_id) VALUES (%s, %s)",
-                    (user["id"], achievement["id"])
-                )
-                create_notification(
-                    db,
-                    user["id"],
-                    "achievement",
-                    f"Achievement Unlocked: {achievement['name']} - {achievement['description']} {achievement['icon']}"
-                )
+        reached = achievement_catalog.rules(db).reached({
+            "habits_completed": (None, total_completed),
+            "pet_level": (None, pet_level)
+        })
+        for message in unlock_achievements(db, user["id"], reached):
+            print(f"Re-unlocked: {message}")
 
         return jsonify({
             "status": "ok",
@@ -2812,13 +3735,14 @@ def reset_achievements():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        db.close()
 
 @app.route("/api/auth/logout", methods=["POST"])
 def logout():
     """
     Logs out a user by clearing their session cookie and removing it from the database.
+    A signed token cannot be revoked on its own, so in "signed" mode this ends
+    all of the user's sessions, on every device, within SESSION_GENERATION_TTL
+    seconds on other workers.
     Returns a success message or an error message.
     """
     session_cookie = request.cookies.get("session")
@@ -2828,10 +3752,23 @@ def logout():
             "message": "No active session."
         }), 400
 
-    db = create_database_connection()
+    g.pop("session_user", None)
+    db = get_db()
     try:
-        # Delete the cookie from the database
-        db.execute("DELETE FROM cookies WHERE cookie_value = %s", (session_cookie,))
+        if SESSION_MODE == "signed" and SessionTokens.looks_signed(session_cookie):
+            # Revoke every token issued for this user, on all devices, by bumping their session generation
+            payload = session_tokens.verify(session_cookie)
+            if payload:
+                row = db.fetchone(
+                    "UPDATE users SET session_generation = session_generation + 1 WHERE id = %s RETURNING session_generation",
+                    (payload["uid"],)
+                )
+                generation = row["session_generation"] if row else -1
+                db.after_commit(lambda: session_generations.set(payload["uid"], generation))
+        else:
+            # Delete the cookie from the database
+            db.execute("DELETE FROM cookies WHERE cookie_value = %s", (session_cookie,))
+            db.after_commit(lambda: session_cache.pop(session_cache_key(session_cookie)))
         
         # Create response with cleared cookie
         response = jsonify({
@@ -2855,9 +3792,458 @@ def logout():
             "status": "error",
             "message": str(e)
         }), 500
+
+@app.cli.command("migrate")
+def migrate_command():
+    """
+    Applies pending migrations from backend/migrations.
+    """
+    settings = database_settings()
+    db = PostgresHandler(
+        host=settings["host"],
+        user=settings["user"],
+        password=settings["password"],
+        database=settings["dbname"],
+        port=settings["port"]
+    )
+    try:
+        applied = migrate(db.conn, echo=click.echo)
+        click.echo(f"Applied {len(applied)} migration(s)." if applied else "Database is up to date.")
+    finally:
+        db.close()
+
+def decay_pets_chunk(db, after_id, chunk_size):
+    """
+    Applies elapsed-time decay to the next chunk of pets (ordered by id) in one
+    statement, and notifies owners of pets whose happiness or health dropped
+    below 30, deduplicated against the last hour like update_pet_time.
+    Returns the last pet id of the chunk and row counts.
+    """
+    ticks = pet_decay_ticks_sql("pets")
+    row = db.fetchone(
+        f"""
+        WITH chunk AS (
+            SELECT id, {ticks} AS ticks
+            FROM pets
+            WHERE id > %(after_id)s
+            ORDER BY id
+            LIMIT %(chunk_size)s
+        ),
+        decayed AS (
+            UPDATE pets
+            SET happiness = GREATEST(0, pets.happiness - pets.happiness_decay_rate * chunk.ticks)::int,
+                health = GREATEST(0, pets.health - pets.health_decay_rate * chunk.ticks)::int,
+                vitals_updated_at = pets.vitals_updated_at + make_interval(secs => chunk.ticks * %(interval)s)
+            FROM chunk
+            WHERE pets.id = chunk.id AND chunk.ticks > 0
+            RETURNING pets.user_id, pets.name, pets.happiness, pets.health
+        ),
+        notified AS (
+            INSERT INTO notifications (user_id, type, message)
+            SELECT decayed.user_id, 'pet', decayed.name || alert.message
+            FROM decayed
+            CROSS JOIN LATERAL (VALUES
+                (decayed.happiness < 30, 'feeling sad', %(sad_message)s),
+                (decayed.health < 30, 'not feeling well', %(sick_message)s)
+            ) AS alert(triggered, marker, message)
+            WHERE alert.triggered
+            AND NOT EXISTS (
+                SELECT 1 FROM notifications n
+                WHERE n.user_id = decayed.user_id
+                AND n.type = 'pet'
+                AND n.created_at > NOW() - INTERVAL '1 hour'
+                AND strpos(n.message, alert.marker) > 0
+            )
+            RETURNING 1
+        )
+        SELECT
+            (SELECT id FROM chunk ORDER BY id DESC LIMIT 1) AS last_id,
+            (SELECT COUNT(*) FROM chunk) AS scanned,
+            (SELECT COUNT(*) FROM decayed) AS decayed,
+            (SELECT COUNT(*) FROM notified) AS notified
+        """,
+        {
+            "after_id": after_id,
+            "chunk_size": chunk_size,
+            "interval": PET_DECAY_INTERVAL_SECONDS,
+            "sad_message": " is feeling sad! Maybe it's time for some attention? 🐾",
+            "sick_message": " is not feeling well! Maybe it needs some care? 🐾"
+        }
+    )
+    db.commit()
+    return row
+
+@app.cli.command("decay-pets")
+@click.option("--chunk-size", default=5000, show_default=True, help="Pets updated per statement.")
+@click.option("--pause", default=0.0, show_default=True, help="Seconds to sleep between chunks.")
+def decay_pets_command(chunk_size, pause):
+    """
+    Applies elapsed-time decay to every pet and sends low-vitals notifications in bulk.
+    Meant to be run on a schedule so pets of inactive owners decay too.
+    """
+    db = create_database_connection()
+    try:
+        after_id = "00000000-0000-0000-0000-000000000000"
+        totals = {"scanned": 0, "decayed": 0, "notified": 0}
+        start = time.monotonic()
+        while True:
+            chunk_start = time.monotonic()
+            row = decay_pets_chunk(db, after_id, chunk_size)
+            if not row["scanned"]:
+                break
+            for key in totals:
+                totals[key] += row[key]
+            elapsed = time.monotonic() - chunk_start
+            click.echo(
+                f"chunk: {row['scanned']} scanned, {row['decayed']} decayed, {row['notified']} notified "
+                f"({row['scanned'] / elapsed if elapsed else 0:.0f} rows/sec)"
+            )
+            after_id = row["last_id"]
+            if pause:
+                time.sleep(pause)
+        elapsed = time.monotonic() - start
+        click.echo(
+            f"done: {totals['scanned']} scanned, {totals['decayed']} decayed, {totals['notified']} notified "
+            f"in {elapsed:.1f}s ({totals['scanned'] / elapsed if elapsed else 0:.0f} rows/sec)"
+        )
+    finally:
+        db.close()
+
+@app.cli.command("refresh-leaderboard")
+def refresh_leaderboard_command():
+    """
+    Recomputes the global leaderboard ranking.
+    """
+    start = time.monotonic()
+    if refresh_global_leaderboard():
+        click.echo(f"Refreshed global leaderboard in {time.monotonic() - start:.2f}s")
+    else:
+        click.echo("Another refresh is already running.")
+
+@app.cli.command("bench-auth")
+@click.option("--email", required=True, help="Existing user to authenticate as.")
+@click.option("--iterations", default=1000, show_default=True)
+def bench_auth(email, iterations):
+    """
+    Compares auth-check latency of database-backed sessions (cold and cached)
+    against signed session tokens.
+    """
+    def run(label, check, before=None):
+        timings = []
+        for _ in range(iterations):
+            if before:
+                before()
+            with app.test_request_context():
+                start = time.perf_counter()
+                if not check():
+                    raise click.ClickException(f"{label}: authentication failed")
+                timings.append((time.perf_counter() - start) * 1000)
+        quantiles = statistics.quantiles(timings, n=20)
+        click.echo(f"{label:<20} p50={quantiles[9]:.3f}ms p95={quantiles[18]:.3f}ms mean={statistics.mean(timings):.3f}ms")
+
+    db = create_database_connection()
+    try:
+        user = db.fetchone(
+            "SELECT id, email, display_name, avatar_url, timezone, session_generation FROM users WHERE email = %s",
+            (email,)
+        )
+        if not user:
+            raise click.ClickException(f"No user with email {email}")
+
+        # Temporary database session and an equivalent signed token
+        cookie_value = str(uuid.uuid4())
+        db.execute(
+            "INSERT INTO cookies (user_id, cookie_value, expires_at) VALUES (%s, %s, NOW() + INTERVAL '1 hour')",
+            (user["id"], cookie_value)
+        )
+        tokens = session_tokens or SessionTokens(os.environ.get("SESSION_SECRET") or uuid.uuid4().hex * 2)
+        token = tokens.issue(user, user["session_generation"], datetime.now(timezone.utc) + timedelta(hours=1))
+        try:
+            run("db (uncached)", lambda: check_db_session(cookie_value), before=session_cache.clear)
+            run("db (session cache)", lambda: check_db_session(cookie_value))
+            run("signed token", lambda: check_signed_session(token, tokens))
+        finally:
+            db.execute("DELETE FROM cookies WHERE cookie_value = %s", (cookie_value,))
+    finally:
+        db.close()
+
+@app.cli.command("reconcile-unread")
+@click.option("--chunk-size", default=1000, show_default=True, help="Users recounted per transaction.")
+def reconcile_unread_command(chunk_size):
+    """
+    Recomputes every user's unread notification counter from the notifications
+    table, fixing and reporting any drift.
+    """
+    db = create_database_connection()
+    try:
+        after_id = "00000000-0000-0000-0000-000000000000"
+        totals = {"users": 0, "drifted": 0, "drift": 0}
+        start = time.monotonic()
+        while True:
+            users = db.fetchall(
+                "SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                (after_id, chunk_size)
+            )
+            if not users:
+                break
+            user_ids = [str(user["id"]) for user in users]
+            # Hold the counters while recounting: concurrent writers wait and then
+            # apply their change on top of the corrected value
+            db.fetchall(
+                "SELECT user_id FROM notification_counters WHERE user_id = ANY(%s::uuid[]) ORDER BY user_id FOR UPDATE",
+                (user_ids,)
+            )
+            row = db.fetchone(
+                """
+                WITH actual AS (
+                    SELECT u.id AS user_id, COUNT(n.id) AS unread
+                    FROM unnest(%s::uuid[]) AS u(id)
+                    LEFT JOIN notifications n ON n.user_id = u.id AND n.read = FALSE
+                    GROUP BY u.id
+                ),
+                drift AS (
+                    SELECT a.user_id, a.unread, COALESCE(c.unread, 0) AS counted
+                    FROM actual a
+                    LEFT JOIN notification_counters c ON c.user_id = a.user_id
+                    WHERE c.unread IS DISTINCT FROM a.unread
+                ),
+                fixed AS (
+                    INSERT INTO notification_counters (user_id, unread)
+                    SELECT user_id, unread FROM drift
+                    ON CONFLICT (user_id) DO UPDATE SET unread = EXCLUDED.unread
+                    RETURNING 1
+                )
+                SELECT
+                    COUNT(*) FILTER (WHERE unread <> counted) AS drifted,
+                    COALESCE(SUM(ABS(unread - counted)), 0) AS drift
+                FROM drift
+                """,
+                (user_ids,)
+            )
+            db.commit()
+            totals["users"] += len(user_ids)
+            totals["drifted"] += row["drifted"]
+            totals["drift"] += row["drift"]
+            after_id = user_ids[-1]
+        elapsed = time.monotonic() - start
+        click.echo(
+            f"done: {totals['users']} users checked, {totals['drifted']} counters off "
+            f"by {totals['drift']} in total, in {elapsed:.1f}s"
+        )
+    finally:
+        db.close()
+
+@app.cli.command("prune-tombstones")
+@click.option("--days", default=30, show_default=True, help="Keep tombstones of rows deleted within this many days.")
+def prune_tombstones_command(days):
+    """
+    Deletes old /api/sync tombstones. Clients whose cursor predates the pruned
+    tombstones are told to resync from scratch.
+    """
+    db = create_database_connection()
+    try:
+        row = db.fetchone(
+            """
+            WITH pruned AS (
+                DELETE FROM deleted_rows
+                WHERE deleted_at < NOW() - make_interval(days => %s)
+                RETURNING change_xid
+            ),
+            horizon AS (
+                UPDATE sync_horizon
+                SET pruned_xid = newest.change_xid
+                FROM (SELECT change_xid FROM pruned ORDER BY change_xid DESC LIMIT 1) AS newest
+                WHERE newest.change_xid > sync_horizon.pruned_xid
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM pruned) AS pruned
+            """,
+            (days,)
+        )
+        db.commit()
+        click.echo(f"Pruned {row['pruned']} tombstones.")
+    finally:
+        db.close()
+
+@app.cli.command("purge-notifications")
+@click.option("--chunk-size", default=1000, show_default=True, help="Notifications deleted per transaction.")
+@click.option("--pause", default=0.1, show_default=True, help="Seconds to sleep between chunks.")
+@click.option("--months-ahead", default=3, show_default=True, help="Monthly partitions to keep ready, when partitioned.")
+def purge_notifications_command(chunk_size, pause, months_ahead):
+    """
+    Deletes notifications past the NOTIFICATION_RETENTION policy in small
+    chunks. When notifications is partitioned, also creates upcoming partitions
+    and drops the ones every rule has expired. Meant to be run on a schedule.
+    """
+    try:
+        policy = parse_retention_policy(
+            os.environ.get("NOTIFICATION_RETENTION", DEFAULT_NOTIFICATION_RETENTION),
+            NOTIFICATION_TYPES
+        )
+    except ValueError as e:
+        raise click.ClickException(f"NOTIFICATION_RETENTION: {e}")
+
+    db = create_database_connection()
+    try:
+        start = time.monotonic()
+        if is_partitioned(db.conn):
+            for name in ensure_partitions(db.conn, months_ahead):
+                click.echo(f"Created partition {name}")
+            # A partition can only go once nothing in it is retained by any rule
+            if None not in policy.values():
+                for name in drop_expired_partitions(db.conn, max(policy.values())):
+                    click.echo(f"Dropped partition {name}")
+
+        total = 0
+        for (notification_type, read), days in sorted(policy.items()):
+            if days is None:
+                continue
+            purged = 0
+            while True:
+                chunk = purge_expired_chunk(db.conn, notification_type, read, days, chunk_size)
+                purged += chunk
+                if chunk < chunk_size:
+                    break
+                if pause:
+                    time.sleep(pause)
+            total += purged
+            state = "read" if read else "unread"
+            click.echo(f"{notification_type} ({state}, older than {days} days): {purged} purged")
+        elapsed = time.monotonic() - start
+        click.echo(f"done: {total} notifications purged in {elapsed:.1f}s")
     finally:
         db.close()
 
+@app.cli.command("partition-notifications")
+@click.option("--months-ahead", default=3, show_default=True, help="Monthly partitions to create past the current month.")
+def partition_notifications_command(months_ahead):
+    """
+    Converts notifications into a table partitioned by month, so that
+    purge-notifications can drop expired months whole. Locks notifications
+    for the duration of the copy; run it during a quiet period.
+    """
+    db = create_database_connection()
+    try:
+        if is_partitioned(db.conn):
+            click.echo("notifications is already partitioned.")
+            return
+        start = time.monotonic()
+        partition_notifications(db.conn, months_ahead)
+        click.echo(f"Partitioned notifications in {time.monotonic() - start:.1f}s.")
+    except Exception:
+        db.conn.rollback()
+        raise
+    finally:
+        db.close()
+
+@app.cli.command("prefetch-weather")
+@click.option("--batch-size", default=100, show_default=True, help="Grid cells per upstream request.")
+def prefetch_weather_command(batch_size):
+    """
+    Fetches the current weather once for every grid cell that has a user with a
+    saved geolocation and stores it in weather_cells for /api/weather to serve.
+    Meant to run on a schedule, ahead of the traffic peak.
+    """
+    db = create_database_connection()
+    try:
+        cells = db.fetchall(
+            """
+            SELECT FLOOR(latitude / %(cell_size)s)::int AS cell_row,
+                FLOOR(longitude / %(cell_size)s)::int AS cell_col,
+                COUNT(*) AS users
+            FROM user_geolocations
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+            """,
+            {"cell_size": weather_client.cell_degrees}
+        )
+        db.commit()
+        users = sum(cell["users"] for cell in cells)
+        click.echo(f"{len(cells)} cells for {users} users")
+
+        upstream_calls = 0
+        stored = 0
+        failed = 0
+        start = time.monotonic()
+        for i in range(0, len(cells), batch_size):
+            batch = [(cell["cell_row"], cell["cell_col"]) for cell in cells[i:i + batch_size]]
+            upstream_calls += 1
+            try:
+                weather = weather_client.fetch_many(batch)
+            except Exception as e:
+                failed += len(batch)
+                click.echo(f"batch of {len(batch)} cells failed: {e}")
+                continue
+            db.execute(
+                """
+                INSERT INTO weather_cells (cell_size, cell_row, cell_col, weather, fetched_at)
+                SELECT %s, cell_row, cell_col, weather, NOW()
+                FROM unnest(%s::int[], %s::int[], %s::text[]) AS w(cell_row, cell_col, weather)
+                ON CONFLICT (cell_size, cell_row, cell_col)
+                DO UPDATE SET weather = EXCLUDED.weather, fetched_at = EXCLUDED.fetched_at
+                """,
+                (
+                    weather_client.cell_degrees,
+                    [cell[0] for cell in weather],
+                    [cell[1] for cell in weather],
+                    list(weather.values())
+                )
+            )
+            stored += len(weather)
+        elapsed = time.monotonic() - start
+        click.echo(
+            f"done: {stored} cells stored, {failed} failed, {upstream_calls} upstream calls "
+            f"in {elapsed:.1f}s ({stored / elapsed if elapsed else 0:.0f} cells/sec)"
+        )
+    finally:
+        db.close()
+
+@app.cli.command("weather-stub")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8081, show_default=True)
+@click.option("--delay", default=0.0, show_default=True, help="Seconds to wait before every response.")
+@click.option("--jitter", default=0.0, show_default=True, help="Extra random delay of up to this many seconds.")
+@click.option("--failure-rate", default=0.0, show_default=True, help="Share of requests that fail (0-1).")
+@click.option("--failure-status", default=503, show_default=True)
+@click.option("--weather-code", default=0, show_default=True, help="WMO code returned for every location.")
+def weather_stub_command(host, port, delay, jitter, failure_rate, failure_status, weather_code):
+    """
+    Serves a local Open-Meteo stand-in with configurable latency and failures.
+    """
+    click.echo(f"Open-Meteo stub on http://{host}:{port}/v1/forecast (set OPEN_METEO_URL to use it)")
+    weather_stub.serve(host, port, weather_stub.StubSettings(
+        delay=delay,
+        jitter=jitter,
+        failure_rate=failure_rate,
+        failure_status=failure_status,
+        weather_code=weather_code
+    ))
+
+@app.cli.command("bench-weather")
+@click.option("--requests", "request_count", default=1000, show_default=True)
+@click.option("--concurrency", default=20, show_default=True)
+@click.option("--cells", default=50, show_default=True, help="Distinct grid cells to spread lookups over.")
+def bench_weather(request_count, concurrency, cells):
+    """
+    Fires concurrent weather lookups at OPEN_METEO_URL (e.g. the weather-stub)
+    and reports caller latency, fallbacks and circuit breaker activity.
+    """
+    def lookup(i):
+        cell = i % cells
+        start = time.perf_counter()
+        weather_client.current(cell * weather_client.cell_degrees, 0)
+        return (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(lookup, range(request_count)))
+    quantiles = statistics.quantiles(timings, n=100)
+    click.echo(
+        f"p50={quantiles[49]:.1f}ms p99={quantiles[98]:.1f}ms max={max(timings):.1f}ms "
+        f"mean={statistics.mean(timings):.1f}ms"
+    )
+    stats = weather_client.stats()
+    click.echo(f"fallbacks={stats['fallbacks']} hit_ratio={stats['hit_ratio']:.2f} breaker={stats['breaker']}")
+
 if __name__ == "__main__":
     app.run(debug=True)
 
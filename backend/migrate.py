@@ -0,0 +1,111 @@
+"""
+Minimal migration runner.
+
+Migrations are the NNNN_description.sql files in migrations/, applied in
+version order and recorded in the schema_migrations table. A migration whose
+first line is "-- migrate:no-transaction" runs statement by statement in
+autocommit mode (needed for CREATE INDEX CONCURRENTLY, and for DO blocks that
+COMMIT between batches); every other migration runs in a single transaction
+together with its bookkeeping row.
+"""
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_[\w-]+\.sql$")
+NO_TRANSACTION = "-- migrate:no-transaction"
+
+
+def available_migrations():
+    """
+    Returns (version, filename) pairs for every migration file, ordered by version.
+    """
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((match.group(1), filename))
+    return sorted(migrations)
+
+
+def applied_versions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                applied_at TIMESTAMPTZ DEFAULT NOW()
+            )
+            """
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    return versions
+
+
+DOLLAR_QUOTE = re.compile(r"(\$\w*\$|;)")
+
+
+def _split_statements(sql):
+    # Strip comment lines first so semicolons inside them are ignored
+    body = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    # Semicolons inside dollar-quoted bodies (DO blocks, functions) do not end a statement
+    statements, current, quote = [], [], None
+    for token in DOLLAR_QUOTE.split(body):
+        if quote is None and token == ";":
+            statements.append("".join(current))
+            current = []
+            continue
+        if token.startswith("$") and token.endswith("$") and len(token) > 1:
+            quote = token if quote is None else (None if token == quote else quote)
+        current.append(token)
+    statements.append("".join(current))
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def apply_migration(conn, version, filename):
+    with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+        sql = f.read()
+
+    if sql.lstrip().startswith(NO_TRANSACTION):
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                for statement in _split_statements(sql):
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, filename) VALUES (%s, %s)",
+                    (version, filename)
+                )
+        finally:
+            conn.autocommit = False
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, filename) VALUES (%s, %s)",
+                (version, filename)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrate(conn, echo=print):
+    """
+    Applies every pending migration in order. Returns the versions that were applied.
+    """
+    done = applied_versions(conn)
+    applied = []
+    for version, filename in available_migrations():
+        if version in done:
+            continue
+        echo(f"Applying {filename}")
+        apply_migration(conn, version, filename)
+        applied.append(version)
+    return applied
@@ -0,0 +1,3 @@
+-- Per-user generation counter used to revoke signed session tokens
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS session_generation INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,11 @@
+-- migrate:no-transaction
+-- Secondary indexes for the lookups every request path depends on.
+-- Built CONCURRENTLY so writes are not blocked while they are created.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cookies_cookie_value_idx ON cookies (cookie_value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habits_user_id_idx ON habits (user_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notifications_user_created_idx ON notifications (user_id, created_at DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notifications_user_unread_idx ON notifications (user_id) WHERE read = FALSE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friends_friend_id_idx ON friends (friend_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friend_requests_to_status_idx ON friend_requests (to_user_id, status);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friend_requests_from_status_idx ON friend_requests (from_user_id, status);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_display_name_idx ON users (display_name);
@@ -0,0 +1,30 @@
+-- Append-only log of every habit completion
+CREATE TABLE IF NOT EXISTS habit_completions (
+    id BIGSERIAL PRIMARY KEY,
+    habit_id UUID REFERENCES habits(id) ON DELETE SET NULL, -- history outlives deleted habits
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS habit_completions_user_completed_idx ON habit_completions (user_id, completed_at DESC);
+CREATE INDEX IF NOT EXISTS habit_completions_habit_completed_idx ON habit_completions (habit_id, completed_at DESC);
+
+-- Seed the log with the last known completion of each habit
+INSERT INTO habit_completions (habit_id, user_id, completed_at)
+SELECT h.id, h.user_id, h.last_completed_at
+FROM habits h
+WHERE h.last_completed_at IS NOT NULL
+AND h.user_id IS NOT NULL
+AND NOT EXISTS (SELECT 1 FROM habit_completions hc WHERE hc.habit_id = h.id);
+
+-- total_habits_completed counts the user's habits completed at least once and is
+-- maintained incrementally from now on, so bring every user's row in line once
+INSERT INTO user_stats (user_id, total_habits_completed, lifetime_habits_completed)
+SELECT u.id, COUNT(h.id), COUNT(h.id)
+FROM users u
+LEFT JOIN habits h ON h.user_id = u.id AND h.last_completed_at IS NOT NULL
+GROUP BY u.id
+ON CONFLICT (user_id) DO UPDATE
+SET total_habits_completed = EXCLUDED.total_habits_completed,
+    lifetime_habits_completed = GREATEST(user_stats.lifetime_habits_completed, EXCLUDED.lifetime_habits_completed),
+    updated_at = NOW();
@@ -0,0 +1,6 @@
+-- Pet happiness/health are stored as of vitals_updated_at and decay lazily:
+-- readers subtract the per-hour rate for every whole hour elapsed since then.
+ALTER TABLE pets
+ADD COLUMN IF NOT EXISTS vitals_updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+ADD COLUMN IF NOT EXISTS happiness_decay_rate INTEGER NOT NULL DEFAULT 2,
+ADD COLUMN IF NOT EXISTS health_decay_rate INTEGER NOT NULL DEFAULT 1;
@@ -0,0 +1,9 @@
+-- Single-row version counter for the achievement catalog. Bumped whenever the
+-- catalog changes so every worker reloads its cached copy.
+CREATE TABLE IF NOT EXISTS achievement_catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO achievement_catalog_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
@@ -0,0 +1,30 @@
+-- Precomputed global ranking. Ranks are dense and stable between refreshes
+-- (ties broken by user id), so any page is an index range scan on rank.
+CREATE MATERIALIZED VIEW IF NOT EXISTS global_leaderboard AS
+SELECT
+    ROW_NUMBER() OVER (
+        ORDER BY COALESCE(us.current_streak, 0) DESC, COALESCE(p.lvl, 1) DESC, u.id
+    ) AS rank,
+    u.id AS user_id,
+    u.display_name AS username,
+    COALESCE(p.name, '') AS pet_name,
+    COALESCE(p.type, '') AS pet_type,
+    COALESCE(p.lvl, 1) AS level,
+    COALESCE(us.current_streak, 0) AS streak,
+    COALESCE(us.total_habits_completed, 0) AS habits_completed,
+    u.avatar_url
+FROM users u
+LEFT JOIN pets p ON p.user_id = u.id
+LEFT JOIN user_stats us ON us.user_id = u.id;
+
+-- Unique indexes: rank for paging, user_id for lookups and REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS global_leaderboard_rank_idx ON global_leaderboard (rank);
+CREATE UNIQUE INDEX IF NOT EXISTS global_leaderboard_user_idx ON global_leaderboard (user_id);
+
+-- When global_leaderboard was last refreshed
+CREATE TABLE IF NOT EXISTS leaderboard_refreshes (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO leaderboard_refreshes (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
@@ -0,0 +1,11 @@
+-- Current weather per grid cell, filled ahead of time by `flask prefetch-weather`.
+-- Cells are FLOOR(coordinate / cell_size); keying on the cell size keeps rows
+-- from an old grid from being read after WEATHER_CELL_DEGREES changes.
+CREATE TABLE IF NOT EXISTS weather_cells (
+    cell_size NUMERIC(6, 4) NOT NULL,
+    cell_row INT NOT NULL,
+    cell_col INT NOT NULL,
+    weather TEXT NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (cell_size, cell_row, cell_col)
+);
@@ -0,0 +1,105 @@
+-- Change tracking for /api/sync. Every tracked row carries the id of the
+-- transaction that last wrote it, and deletions leave a tombstone in
+-- deleted_rows. A sync cursor is the xmin of the snapshot taken at sync time:
+-- everything written by transactions below it was visible then, so the next
+-- sync only needs rows with change_xid >= cursor.
+--
+-- Adding the column with its volatile default would rewrite every table under
+-- an exclusive lock. It is added empty instead and the default set separately,
+-- both catalog-only changes; 0013 backfills existing rows in batches and adds
+-- NOT NULL and the lookup indexes afterwards.
+ALTER TABLE habits ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE pets ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE friends ADD COLUMN IF NOT EXISTS change_xid xid8;
+ALTER TABLE habits ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE pets ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE user_stats ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE notifications ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE friends ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+
+CREATE TABLE IF NOT EXISTS deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL, -- no foreign key: tombstones outlive the rows they describe
+    table_name TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Newest transaction whose tombstones were pruned; older cursors must resync from scratch
+CREATE TABLE IF NOT EXISTS sync_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_xid xid8 NOT NULL DEFAULT '0'
+);
+
+INSERT INTO sync_horizon (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION touch_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level so bulk deletes write their tombstones in one INSERT.
+-- TG_ARGV[0] is the column holding the owning user, TG_ARGV[1] the column
+-- identifying the row. Rows removed because their user was deleted are skipped.
+CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO deleted_rows (user_id, table_name, row_id)
+         SELECT d.%1$I, %2$L, d.%3$I::text
+         FROM deleted_transition d
+         WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = d.%1$I)',
+        TG_ARGV[0], TG_TABLE_NAME, TG_ARGV[1]
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS habits_touch_change_xid ON habits;
+CREATE TRIGGER habits_touch_change_xid BEFORE UPDATE ON habits
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+DROP TRIGGER IF EXISTS pets_touch_change_xid ON pets;
+CREATE TRIGGER pets_touch_change_xid BEFORE UPDATE ON pets
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+DROP TRIGGER IF EXISTS user_stats_touch_change_xid ON user_stats;
+CREATE TRIGGER user_stats_touch_change_xid BEFORE UPDATE ON user_stats
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+DROP TRIGGER IF EXISTS notifications_touch_change_xid ON notifications;
+CREATE TRIGGER notifications_touch_change_xid BEFORE UPDATE ON notifications
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+DROP TRIGGER IF EXISTS friends_touch_change_xid ON friends;
+CREATE TRIGGER friends_touch_change_xid BEFORE UPDATE ON friends
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+
+DROP TRIGGER IF EXISTS habits_record_deleted ON habits;
+CREATE TRIGGER habits_record_deleted AFTER DELETE ON habits
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+DROP TRIGGER IF EXISTS pets_record_deleted ON pets;
+CREATE TRIGGER pets_record_deleted AFTER DELETE ON pets
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+DROP TRIGGER IF EXISTS user_stats_record_deleted ON user_stats;
+CREATE TRIGGER user_stats_record_deleted AFTER DELETE ON user_stats
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'user_id');
+DROP TRIGGER IF EXISTS notifications_record_deleted ON notifications;
+CREATE TRIGGER notifications_record_deleted AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+-- A friendship belongs to both users, so each side gets a tombstone naming the other
+DROP TRIGGER IF EXISTS friends_record_deleted ON friends;
+CREATE TRIGGER friends_record_deleted AFTER DELETE ON friends
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'friend_id');
+DROP TRIGGER IF EXISTS friends_record_deleted_reverse ON friends;
+CREATE TRIGGER friends_record_deleted_reverse AFTER DELETE ON friends
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('friend_id', 'user_id');
+
+CREATE INDEX IF NOT EXISTS deleted_rows_user_change_idx ON deleted_rows (user_id, change_xid);
+CREATE INDEX IF NOT EXISTS deleted_rows_deleted_at_idx ON deleted_rows (deleted_at);
@@ -0,0 +1,48 @@
+-- Publishes every notification change on the owner's channel
+-- (notifications_<user id>) for /api/notifications/stream. Payloads stay well
+-- below the 8000 byte NOTIFY limit by truncating the message.
+CREATE OR REPLACE FUNCTION publish_notification_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'created',
+            'id', n.id,
+            'type', n.type,
+            'message', left(n.message, 2000),
+            'read', n.read,
+            'created_at', n.created_at
+        )::text)
+        FROM new_rows n;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'updated',
+            'id', n.id,
+            'read', n.read
+        )::text)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE n.read IS DISTINCT FROM o.read;
+    ELSE
+        PERFORM pg_notify('notifications_' || o.user_id, json_build_object(
+            'event', 'deleted',
+            'id', o.id,
+            'read', o.read
+        )::text)
+        FROM old_rows o;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notifications_publish_insert ON notifications;
+CREATE TRIGGER notifications_publish_insert AFTER INSERT ON notifications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
+DROP TRIGGER IF EXISTS notifications_publish_update ON notifications;
+CREATE TRIGGER notifications_publish_update AFTER UPDATE ON notifications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
+DROP TRIGGER IF EXISTS notifications_publish_delete ON notifications;
+CREATE TRIGGER notifications_publish_delete AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
@@ -0,0 +1,107 @@
+-- Unread notification count per user, kept in step with notifications by
+-- statement-level triggers so every write path updates it in the same
+-- transaction. `flask reconcile-unread` recomputes it and reports drift.
+CREATE TABLE IF NOT EXISTS notification_counters (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    unread INTEGER NOT NULL DEFAULT 0
+);
+
+-- Applies the net change in unread notifications per user. Counter rows are
+-- locked in user order so concurrent multi-user statements cannot deadlock.
+CREATE OR REPLACE FUNCTION count_unread_notifications() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO notification_counters AS c (user_id, unread)
+        SELECT user_id, COUNT(*)
+        FROM new_rows
+        WHERE read = FALSE AND user_id IS NOT NULL
+        GROUP BY user_id
+        ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET unread = c.unread + EXCLUDED.unread;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO notification_counters AS c (user_id, unread)
+        SELECT n.user_id, SUM((n.read = FALSE)::int - (o.read = FALSE)::int)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE n.user_id IS NOT NULL
+        GROUP BY n.user_id
+        HAVING SUM((n.read = FALSE)::int - (o.read = FALSE)::int) <> 0
+        ORDER BY n.user_id
+        ON CONFLICT (user_id) DO UPDATE SET unread = GREATEST(0, c.unread + EXCLUDED.unread);
+    ELSE
+        -- Counter rows of deleted users are already gone, so nothing is recreated for them
+        UPDATE notification_counters c
+        SET unread = GREATEST(0, c.unread - removed.unread)
+        FROM (
+            SELECT user_id, COUNT(*) AS unread
+            FROM old_rows
+            WHERE read = FALSE
+            GROUP BY user_id
+            ORDER BY user_id
+        ) AS removed
+        WHERE c.user_id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notifications_count_insert ON notifications;
+CREATE TRIGGER notifications_count_insert AFTER INSERT ON notifications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+DROP TRIGGER IF EXISTS notifications_count_update ON notifications;
+CREATE TRIGGER notifications_count_update AFTER UPDATE ON notifications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+DROP TRIGGER IF EXISTS notifications_count_delete ON notifications;
+CREATE TRIGGER notifications_count_delete AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+
+-- Change events now carry the user's unread count after the change. The count
+-- triggers fire before the publish triggers (triggers run in name order).
+CREATE OR REPLACE FUNCTION publish_notification_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'created',
+            'id', n.id,
+            'type', n.type,
+            'message', left(n.message, 2000),
+            'read', n.read,
+            'created_at', n.created_at,
+            'unread', c.unread
+        )::text)
+        FROM new_rows n
+        LEFT JOIN notification_counters c ON c.user_id = n.user_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'updated',
+            'id', n.id,
+            'read', n.read,
+            'unread', c.unread
+        )::text)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        LEFT JOIN notification_counters c ON c.user_id = n.user_id
+        WHERE n.read IS DISTINCT FROM o.read;
+    ELSE
+        PERFORM pg_notify('notifications_' || o.user_id, json_build_object(
+            'event', 'deleted',
+            'id', o.id,
+            'read', o.read,
+            'unread', c.unread
+        )::text)
+        FROM old_rows o
+        LEFT JOIN notification_counters c ON c.user_id = o.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO notification_counters (user_id, unread)
+SELECT user_id, COUNT(*)
+FROM notifications
+WHERE read = FALSE AND user_id IS NOT NULL
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET unread = EXCLUDED.unread;
@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Lets `flask purge-notifications` find expired notifications of one type
+-- without scanning the whole table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notifications_type_created_idx ON notifications (type, created_at);
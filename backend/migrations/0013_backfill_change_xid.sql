@@ -0,0 +1,58 @@
+-- migrate:no-transaction
+-- Second half of 0009: fills change_xid on rows that existed before it was
+-- added, 1000 pages per transaction so no table is locked for long. Rows
+-- written meanwhile already get it from the column default or the update
+-- trigger. The ctid ranges are read with TID range scans (Postgres 14+).
+DO $$
+DECLARE
+    tracked TEXT;
+    pages BIGINT;
+    first_page BIGINT;
+BEGIN
+    FOREACH tracked IN ARRAY ARRAY['habits', 'pets', 'user_stats', 'notifications', 'friends'] LOOP
+        pages := pg_relation_size(tracked::regclass) / current_setting('block_size')::int;
+        first_page := 0;
+        WHILE first_page <= pages LOOP
+            EXECUTE format(
+                'UPDATE %I SET change_xid = pg_current_xact_id()
+                 WHERE ctid >= %L::tid AND ctid < %L::tid AND change_xid IS NULL',
+                tracked, format('(%s,0)', first_page), format('(%s,0)', first_page + 1000)
+            );
+            COMMIT;
+            first_page := first_page + 1000;
+        END LOOP;
+    END LOOP;
+END
+$$;
+
+-- NOT NULL through a validated CHECK, so SET NOT NULL skips its own scan under an exclusive lock
+ALTER TABLE habits DROP CONSTRAINT IF EXISTS habits_change_xid_not_null;
+ALTER TABLE habits ADD CONSTRAINT habits_change_xid_not_null CHECK (change_xid IS NOT NULL) NOT VALID;
+ALTER TABLE habits VALIDATE CONSTRAINT habits_change_xid_not_null;
+ALTER TABLE habits ALTER COLUMN change_xid SET NOT NULL;
+ALTER TABLE habits DROP CONSTRAINT habits_change_xid_not_null;
+ALTER TABLE pets DROP CONSTRAINT IF EXISTS pets_change_xid_not_null;
+ALTER TABLE pets ADD CONSTRAINT pets_change_xid_not_null CHECK (change_xid IS NOT NULL) NOT VALID;
+ALTER TABLE pets VALIDATE CONSTRAINT pets_change_xid_not_null;
+ALTER TABLE pets ALTER COLUMN change_xid SET NOT NULL;
+ALTER TABLE pets DROP CONSTRAINT pets_change_xid_not_null;
+ALTER TABLE user_stats DROP CONSTRAINT IF EXISTS user_stats_change_xid_not_null;
+ALTER TABLE user_stats ADD CONSTRAINT user_stats_change_xid_not_null CHECK (change_xid IS NOT NULL) NOT VALID;
+ALTER TABLE user_stats VALIDATE CONSTRAINT user_stats_change_xid_not_null;
+ALTER TABLE user_stats ALTER COLUMN change_xid SET NOT NULL;
+ALTER TABLE user_stats DROP CONSTRAINT user_stats_change_xid_not_null;
+ALTER TABLE notifications DROP CONSTRAINT IF EXISTS notifications_change_xid_not_null;
+ALTER TABLE notifications ADD CONSTRAINT notifications_change_xid_not_null CHECK (change_xid IS NOT NULL) NOT VALID;
+ALTER TABLE notifications VALIDATE CONSTRAINT notifications_change_xid_not_null;
+ALTER TABLE notifications ALTER COLUMN change_xid SET NOT NULL;
+ALTER TABLE notifications DROP CONSTRAINT notifications_change_xid_not_null;
+ALTER TABLE friends DROP CONSTRAINT IF EXISTS friends_change_xid_not_null;
+ALTER TABLE friends ADD CONSTRAINT friends_change_xid_not_null CHECK (change_xid IS NOT NULL) NOT VALID;
+ALTER TABLE friends VALIDATE CONSTRAINT friends_change_xid_not_null;
+ALTER TABLE friends ALTER COLUMN change_xid SET NOT NULL;
+ALTER TABLE friends DROP CONSTRAINT friends_change_xid_not_null;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS habits_user_change_idx ON habits (user_id, change_xid);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notifications_user_change_idx ON notifications (user_id, change_xid);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friends_user_change_idx ON friends (user_id, change_xid);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS friends_friend_change_idx ON friends (friend_id, change_xid);
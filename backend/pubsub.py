@@ -0,0 +1,192 @@
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+
+import psycopg2
+
+
+class NotificationHub:
+    """
+    Fans Postgres NOTIFY events out to in-process subscribers.
+
+    A single dedicated connection per worker LISTENs on the per-user channel
+    (channel_prefix + user id) of every user with at least one open
+    subscription, so any number of open streams costs one database connection.
+    Each subscriber gets its own bounded queue of raw payloads; a subscriber
+    that falls behind has its queue replaced by a single RESYNC marker, as does
+    everyone once the listener connection had to be re-established.
+    """
+
+    RESYNC = object()
+
+    def __init__(self, channel_prefix="notifications_", queue_size=100, reconnect_delay=1,
+                 listen_timeout=5, **connect_kwargs):
+        self.channel_prefix = channel_prefix
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.listen_timeout = listen_timeout  # seconds subscribe() waits for the LISTEN
+        self._connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user id -> set of queues
+        self._listening = {}  # user id -> Event set once the user's LISTEN is active
+        self._late = {}  # user id -> queues whose subscribe() stopped waiting for the LISTEN
+        self._pending = deque()  # LISTEN/UNLISTEN commands for the listener thread
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = None
+        self._stats = {
+            "delivered": 0,
+            "dropped": 0,
+            "reconnects": 0,
+        }
+
+    def channel(self, user_id):
+        return f"{self.channel_prefix}{user_id}"
+
+    def subscribe(self, user_id):
+        """
+        Returns a queue that receives the payload of every event for the user.
+        Pass it to unsubscribe() once the subscriber goes away.
+
+        Returns once the user's channel is being listened on, so state read
+        afterwards cannot miss a change. If that takes longer than
+        listen_timeout, the queue instead gets a RESYNC marker as soon as the
+        LISTEN is active.
+        """
+        user_id = str(user_id)
+        subscription = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            subscriptions = self._subscribers.setdefault(user_id, set())
+            if not subscriptions:
+                self._listening[user_id] = threading.Event()
+                self._pending.append(("LISTEN", user_id, self._listening[user_id]))
+            subscriptions.add(subscription)
+            listening = self._listening[user_id]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notification-hub", daemon=True)
+                self._thread.start()
+        self._wake()
+        if not listening.wait(self.listen_timeout):
+            with self._lock:
+                if not listening.is_set():
+                    self._late.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        user_id = str(user_id)
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            self._late.get(user_id, set()).discard(subscription)
+            if not subscriptions:
+                del self._subscribers[user_id]
+                del self._listening[user_id]
+                self._late.pop(user_id, None)
+                self._pending.append(("UNLISTEN", user_id, None))
+        self._wake()
+
+    def _wake(self):
+        os.write(self._wake_write, b"\0")
+
+    def _run(self):
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._connect_kwargs)
+                conn.autocommit = True
+                with self._lock:
+                    # Start from the current subscriptions; queued commands are already reflected in them
+                    self._pending.clear()
+                    listening = dict(self._listening)
+                with conn.cursor() as cursor:
+                    for user_id in listening:
+                        cursor.execute(f'LISTEN "{self.channel(user_id)}"')
+                with self._lock:
+                    for user_id, event in listening.items():
+                        self._confirm(user_id, event)
+                    if reconnecting:
+                        # Events may have been missed while disconnected; only now
+                        # that the LISTENs are back can a reload not miss any more
+                        for subscriptions in self._subscribers.values():
+                            for subscription in subscriptions:
+                                self._resync(subscription)
+                reconnecting = False
+                self._listen(conn)
+            except Exception as e:
+                print(f"Notification listener failed, reconnecting: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            with self._lock:
+                self._stats["reconnects"] += 1
+                reconnecting = True
+                # New subscribers wait for the LISTENs of the next connection
+                for event in self._listening.values():
+                    event.clear()
+            time.sleep(self.reconnect_delay)
+
+    def _listen(self, conn):
+        while True:
+            with self._lock:
+                commands = list(self._pending)
+                self._pending.clear()
+            if commands:
+                with conn.cursor() as cursor:
+                    for command, user_id, _ in commands:
+                        cursor.execute(f'{command} "{self.channel(user_id)}"')
+                with self._lock:
+                    for command, user_id, event in commands:
+                        if command == "LISTEN":
+                            self._confirm(user_id, event)
+
+            readable, _, _ = select.select([conn, self._wake_read], [], [], 30)
+            if self._wake_read in readable:
+                os.read(self._wake_read, 4096)
+            # Polling on timeouts as well notices a dead connection
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self._dispatch(notify.channel[len(self.channel_prefix):], notify.payload)
+
+    def _confirm(self, user_id, listening):
+        # Called with the lock held once the LISTEN queued with this event has
+        # executed; events of users who unsubscribed since are stale
+        if self._listening.get(user_id) is not listening:
+            return
+        listening.set()
+        for subscription in self._late.pop(user_id, ()):
+            self._resync(subscription)
+
+    def _dispatch(self, user_id, payload):
+        with self._lock:
+            for subscription in self._subscribers.get(user_id, ()):
+                try:
+                    subscription.put_nowait(payload)
+                    self._stats["delivered"] += 1
+                except queue.Full:
+                    self._stats["dropped"] += 1
+                    self._resync(subscription)
+
+    @classmethod
+    def _resync(cls, subscription):
+        # Whatever was queued is superseded by telling the subscriber to reload
+        with subscription.mutex:
+            subscription.queue.clear()
+        try:
+            subscription.put_nowait(cls.RESYNC)
+        except queue.Full:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "subscriptions": sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+                "listening": self._thread is not None,
+                **self._stats,
+            }
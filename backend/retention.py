@@ -0,0 +1,345 @@
+"""
+Notification retention.
+
+The policy comes from NOTIFICATION_RETENTION, a comma-separated list of
+<type>[:read|:unread]=<days> rules, e.g. "habit:read=30,*:read=90,*:unread=365".
+"*" matches every type, a rule without a read state covers read and unread
+notifications alike, and "forever" keeps them indefinitely. The most specific
+rule wins; notifications no rule covers are kept.
+
+`flask purge-notifications` deletes expired notifications in small chunks,
+each in its own short transaction, so the statement-level triggers keep the
+unread counters, sync tombstones and change events up to date without holding
+locks for long.
+
+`flask partition-notifications` optionally converts notifications into a table
+partitioned by month of created_at. The purge job then also creates upcoming
+partitions and drops whole partitions once every rule has expired them, which
+is O(1) instead of a delete per row. Rows of months without a partition go to
+a default partition, so a missed purge run never makes inserts fail; they are
+moved into their month's partition once it is created.
+"""
+import re
+from datetime import datetime, timezone
+
+from psycopg2 import sql
+
+DEFAULT_NOTIFICATION_RETENTION = "habit:read=30,pet:read=30,*:read=90"
+READ_STATES = {"read": True, "unread": False}
+DEFAULT_PARTITION = "notifications_default"
+PARTITION_NAME = re.compile(r"^notifications_p(\d{4})_(\d{2})$")
+
+
+def parse_retention_policy(spec, types):
+    """
+    Parses a retention spec into {(type, read): days}, with None for
+    notifications that are kept forever. Raises ValueError on invalid rules.
+    """
+    # Rules are applied from least to most specific so the most specific one wins
+    rules = []
+    for rule in filter(None, (part.strip() for part in spec.split(","))):
+        target, separator, value = rule.partition("=")
+        notification_type, _, state = target.strip().partition(":")
+        if not separator or (notification_type != "*" and notification_type not in types):
+            raise ValueError(f"Invalid retention rule: {rule!r}")
+        if state and state not in READ_STATES:
+            raise ValueError(f"Invalid read state in retention rule {rule!r}, must be read or unread")
+        value = value.strip()
+        if value == "forever":
+            days = None
+        elif value.isdigit() and int(value) > 0:
+            days = int(value)
+        else:
+            raise ValueError(f"Invalid retention period in rule {rule!r}, must be a number of days or forever")
+        specificity = (notification_type != "*") * 2 + bool(state)
+        rules.append((specificity, notification_type, state, days))
+
+    policy = {(notification_type, read): None for notification_type in types for read in (True, False)}
+    for _, notification_type, state, days in sorted(rules, key=lambda rule: rule[0]):
+        for key in policy:
+            if notification_type in ("*", key[0]) and (not state or READ_STATES[state] == key[1]):
+                policy[key] = days
+    return policy
+
+
+def purge_expired_chunk(conn, notification_type, read, days, chunk_size):
+    """
+    Deletes up to chunk_size notifications of one type and read state older
+    than days, and commits. Rows locked by a concurrent writer are skipped and
+    picked up by a later run. Returns the number of notifications deleted.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            sql.SQL(
+                """
+                WITH expired AS (
+                    SELECT id, created_at FROM notifications
+                    WHERE type = %(type)s AND {read}
+                    AND created_at < NOW() - make_interval(days => %(days)s)
+                    LIMIT %(chunk_size)s
+                    FOR UPDATE SKIP LOCKED
+                ),
+                purged AS (
+                    DELETE FROM notifications n
+                    USING expired
+                    WHERE n.id = expired.id AND n.created_at = expired.created_at
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM purged
+                """
+            ).format(read=sql.SQL("read = TRUE" if read else "read IS NOT TRUE")),
+            {"type": notification_type, "days": days, "chunk_size": chunk_size}
+        )
+        purged = cursor.fetchone()[0]
+    conn.commit()
+    return purged
+
+
+def is_partitioned(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = 'notifications'::regclass")
+        return cursor.fetchone()[0]
+
+
+def _month(year, month):
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def _create_default_partition(cursor):
+    """
+    Creates the partition catching rows no monthly partition covers, so inserts
+    keep working when partitions were not created in time. Returns its name if
+    it had to be created.
+    """
+    cursor.execute("SELECT to_regclass(%s) IS NULL", (DEFAULT_PARTITION,))
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF notifications DEFAULT").format(
+        sql.Identifier(DEFAULT_PARTITION)
+    ))
+    return DEFAULT_PARTITION
+
+
+def _create_partitions(cursor, first, last):
+    """
+    Creates the monthly partitions from the month of first through the month
+    of last that do not exist yet. Rows of a new month that already landed in
+    the default partition are moved into it. Returns the names of the new
+    partitions.
+    """
+    created = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        start, end = _month(year, month), _month(year, month + 1)
+        name = f"notifications_p{year:04d}_{month:02d}"
+        partition = sql.Identifier(name)
+        cursor.execute(
+            "SELECT to_regclass(%s) IS NULL, to_regclass(%s) IS NOT NULL",
+            (name, DEFAULT_PARTITION)
+        )
+        missing, has_default = cursor.fetchone()
+        if not missing:
+            year, month = end.year, end.month
+            continue
+        stranded = False
+        if has_default:
+            # Adding a partition locks the default one anyway; taking the lock first
+            # keeps inserts from stranding more rows of the month until it exists
+            cursor.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(
+                sql.Identifier(DEFAULT_PARTITION)
+            ))
+            cursor.execute(
+                sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE created_at >= %s AND created_at < %s)").format(
+                    sql.Identifier(DEFAULT_PARTITION)
+                ),
+                (start, end)
+            )
+            stranded = cursor.fetchone()[0]
+        if stranded:
+            # Attaching would fail while the default partition holds rows of the
+            # month. Statement triggers live on the parent table, so moving the
+            # rows between partitions directly leaves counters and events alone.
+            cursor.execute(
+                sql.SQL("CREATE TABLE {} (LIKE notifications INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(
+                    partition
+                )
+            )
+            cursor.execute(
+                sql.SQL(
+                    """
+                    WITH moved AS (
+                        DELETE FROM {default}
+                        WHERE created_at >= %s AND created_at < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {partition} SELECT * FROM moved
+                    """
+                ).format(default=sql.Identifier(DEFAULT_PARTITION), partition=partition),
+                (start, end)
+            )
+            cursor.execute(
+                sql.SQL("ALTER TABLE notifications ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(
+                    partition
+                ),
+                (start, end)
+            )
+        else:
+            cursor.execute(
+                sql.SQL("CREATE TABLE {} PARTITION OF notifications FOR VALUES FROM (%s) TO (%s)").format(
+                    partition
+                ),
+                (start, end)
+            )
+        created.append(name)
+        year, month = end.year, end.month
+    return created
+
+
+def ensure_partitions(conn, months_ahead):
+    """
+    Creates the partitions for the current month and the next months_ahead
+    months, and the default partition if it is missing. Returns the new names.
+    """
+    now = datetime.now(timezone.utc)
+    with conn.cursor() as cursor:
+        created = _create_partitions(cursor, now, _month(now.year, now.month + months_ahead))
+        if _create_default_partition(cursor):
+            created.append(DEFAULT_PARTITION)
+    conn.commit()
+    return created
+
+
+def drop_expired_partitions(conn, keep_days, lock_timeout="5s"):
+    """
+    Drops the monthly partitions whose newest possible row is older than
+    keep_days. Dropping a partition fires no delete triggers, so the unread
+    counters are adjusted here and, when rows were dropped, the sync horizon is
+    moved past them so clients resync from scratch instead of missing the
+    deletions. A partition whose lock is not granted within lock_timeout is
+    left for the next run rather than queueing every notification query
+    behind it. Returns the names of the dropped partitions.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'notifications'::regclass
+            AND c.relname < 'notifications_p' || to_char(
+                (NOW() - make_interval(days => %s)) AT TIME ZONE 'UTC', 'YYYY_MM'
+            )
+            ORDER BY c.relname
+            """,
+            (keep_days,)
+        )
+        # Everything before the month that still holds rows within keep_days
+        partitions = [row[0] for row in cursor.fetchall() if PARTITION_NAME.match(row[0])]
+    conn.commit()
+
+    dropped = []
+    for name in partitions:
+        partition = sql.Identifier(name)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+                cursor.execute("LOCK TABLE notifications IN ACCESS EXCLUSIVE MODE")
+                cursor.execute(
+                    sql.SQL(
+                        """
+                        UPDATE notification_counters c
+                        SET unread = GREATEST(0, c.unread - removed.unread)
+                        FROM (
+                            SELECT user_id, COUNT(*) AS unread
+                            FROM {}
+                            WHERE read = FALSE
+                            GROUP BY user_id
+                        ) AS removed
+                        WHERE c.user_id = removed.user_id
+                        """
+                    ).format(partition)
+                )
+                cursor.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(partition))
+                if cursor.fetchone()[0]:
+                    cursor.execute("UPDATE sync_horizon SET pruned_xid = pg_current_xact_id()")
+                cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Could not drop partition {name}, retrying on the next run: {e}")
+            continue
+        dropped.append(name)
+    return dropped
+
+
+def partition_notifications(conn, months_ahead):
+    """
+    Converts notifications into a table partitioned by month of created_at, in
+    one transaction that holds an exclusive lock on notifications throughout.
+    Rows are copied into monthly partitions, a default partition catches rows
+    outside of them, and the indexes, foreign keys and
+    triggers of the original table are recreated on the partitioned one. The
+    primary key becomes (id, created_at), since it has to include the
+    partition key.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE notifications IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("UPDATE notifications SET created_at = NOW() WHERE created_at IS NULL")
+        cursor.execute(
+            """
+            SELECT pg_get_indexdef(indexrelid) FROM pg_index
+            WHERE indrelid = 'notifications'::regclass AND NOT indisprimary
+            """
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = 'notifications'::regclass AND contype = 'f'
+            """
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT pg_get_triggerdef(oid) FROM pg_trigger
+            WHERE tgrelid = 'notifications'::regclass AND NOT tgisinternal
+            """
+        )
+        triggers = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT COALESCE(MIN(created_at), NOW()), GREATEST(MAX(created_at), NOW())
+            FROM notifications
+            """
+        )
+        first, newest = cursor.fetchone()
+
+        cursor.execute("ALTER TABLE notifications RENAME TO notifications_unpartitioned")
+        cursor.execute(
+            """
+            CREATE TABLE notifications (
+                LIKE notifications_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+            ) PARTITION BY RANGE (created_at)
+            """
+        )
+        cursor.execute("ALTER TABLE notifications ALTER COLUMN created_at SET NOT NULL")
+        cursor.execute("ALTER TABLE notifications ADD CONSTRAINT notifications_pkey PRIMARY KEY (id, created_at)")
+        now = datetime.now(timezone.utc)
+        last = max(newest, _month(now.year, now.month + months_ahead))
+        _create_partitions(cursor, first.astimezone(timezone.utc), last.astimezone(timezone.utc))
+        _create_default_partition(cursor)
+        # No triggers exist on the new table yet, so the copy leaves counters,
+        # tombstones and change events alone
+        cursor.execute("INSERT INTO notifications SELECT * FROM notifications_unpartitioned")
+        cursor.execute("DROP TABLE notifications_unpartitioned")
+
+        for name, definition in foreign_keys:
+            cursor.execute(
+                sql.SQL("ALTER TABLE notifications ADD CONSTRAINT {} {}").format(
+                    sql.Identifier(name), sql.SQL(definition)
+                )
+            )
+        for statement in indexes + triggers:
+            cursor.execute(statement)
+    conn.commit()
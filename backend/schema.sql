@@ -5,7 +5,8 @@ CREATE TABLE users (
     avatar_url TEXT,
     timezone TEXT,  -- e.g., 'America/Los_Angeles'
     created_at TIMESTAMPTZ DEFAULT NOW(),
-    last_login_at TIMESTAMPTZ
+    last_login_at TIMESTAMPTZ,
+    session_generation INTEGER NOT NULL DEFAULT 0 -- bumped on logout to revoke signed session tokens
 );
 
 CREATE TABLE user_geolocations (
@@ -38,7 +39,8 @@ CREATE TABLE habits (
     -- Time of the last successful completion (UTC)
     last_completed_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ DEFAULT NOW(),
-    archived BOOLEAN DEFAULT FALSE
+    archived BOOLEAN DEFAULT FALSE,
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id() -- transaction that last wrote the row, see /api/sync
 );
 
 CREATE TABLE pets (
@@ -50,13 +52,19 @@ CREATE TABLE pets (
     xp INTEGER NOT NULL CHECK (xp BETWEEN 0 AND 100) DEFAULT 0,
     health INTEGER NOT NULL CHECK (health BETWEEN 0 AND 100) DEFAULT 100,
     lvl INTEGER NOT NULL DEFAULT 0,
-    created_at TIMESTAMPTZ DEFAULT NOW()
+    -- happiness/health are as of vitals_updated_at and lose their decay rate every hour after it
+    vitals_updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    happiness_decay_rate INTEGER NOT NULL DEFAULT 2,
+    health_decay_rate INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id()
 );
 
 CREATE TABLE friends (
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
     friend_id UUID REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMPTZ DEFAULT NOW(),
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
     PRIMARY KEY (user_id, friend_id),
     CHECK (user_id <> friend_id)
 );
@@ -73,10 +81,18 @@ CREATE TABLE user_stats (
     user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
     current_streak INTEGER DEFAULT 0 NOT NULL, -- check if should reset on login or someone loads their profile, or friends page load
     longest_streak INTEGER DEFAULT 0 NOT NULL,
-    total_habits_completed INTEGER DEFAULT 0 NOT NULL,
-    lifetime_habits_completed INTEGER DEFAULT 0 NOT NULL, 
+    total_habits_completed INTEGER DEFAULT 0 NOT NULL, -- habits completed at least once, maintained by complete_habit/delete_habit
+    lifetime_habits_completed INTEGER DEFAULT 0 NOT NULL, -- every completion ever logged in habit_completions
     last_completed_at TIMESTAMPTZ,
-    updated_at TIMESTAMPTZ DEFAULT NOW()
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id()
+);
+
+CREATE TABLE habit_completions (
+    id BIGSERIAL PRIMARY KEY,
+    habit_id UUID REFERENCES habits(id) ON DELETE SET NULL, -- history outlives deleted habits
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    completed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
 CREATE TABLE user_passwords (
@@ -101,7 +117,8 @@ CREATE TABLE notifications (
     type TEXT NOT NULL CHECK (type IN ('habit', 'pet', 'friend', 'achievement')),
     message TEXT NOT NULL,
     read BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMPTZ DEFAULT NOW()
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id()
 );
 
 CREATE TABLE achievements (
@@ -121,6 +138,15 @@ CREATE TABLE user_achievements (
     PRIMARY KEY (user_id, achievement_id)
 );
 
+-- Single-row version counter, bumped whenever the achievement catalog changes
+CREATE TABLE achievement_catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO achievement_catalog_version (id) VALUES (TRUE);
+
 CREATE TABLE user_settings (
     user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
     notifications BOOLEAN DEFAULT TRUE,
@@ -131,5 +157,266 @@ CREATE TABLE user_settings (
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Precomputed global ranking. Ranks are dense and stable between refreshes
+-- (ties broken by user id), so any page is an index range scan on rank.
+CREATE MATERIALIZED VIEW global_leaderboard AS
+SELECT
+    ROW_NUMBER() OVER (
+        ORDER BY COALESCE(us.current_streak, 0) DESC, COALESCE(p.lvl, 1) DESC, u.id
+    ) AS rank,
+    u.id AS user_id,
+    u.display_name AS username,
+    COALESCE(p.name, '') AS pet_name,
+    COALESCE(p.type, '') AS pet_type,
+    COALESCE(p.lvl, 1) AS level,
+    COALESCE(us.current_streak, 0) AS streak,
+    COALESCE(us.total_habits_completed, 0) AS habits_completed,
+    u.avatar_url
+FROM users u
+LEFT JOIN pets p ON p.user_id = u.id
+LEFT JOIN user_stats us ON us.user_id = u.id;
+
+-- Unique indexes: rank for paging, user_id for lookups and REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX global_leaderboard_rank_idx ON global_leaderboard (rank);
+CREATE UNIQUE INDEX global_leaderboard_user_idx ON global_leaderboard (user_id);
+
+-- When global_leaderboard was last refreshed
+CREATE TABLE leaderboard_refreshes (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO leaderboard_refreshes (id) VALUES (TRUE);
+
+-- Current weather per grid cell (FLOOR(coordinate / cell_size)), filled by `flask prefetch-weather`
+CREATE TABLE weather_cells (
+    cell_size NUMERIC(6, 4) NOT NULL,
+    cell_row INT NOT NULL,
+    cell_col INT NOT NULL,
+    weather TEXT NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (cell_size, cell_row, cell_col)
+);
+
+-- Tombstones of deleted tracked rows, see /api/sync
+CREATE TABLE deleted_rows (
+    id BIGSERIAL PRIMARY KEY,
+    user_id UUID NOT NULL, -- no foreign key: tombstones outlive the rows they describe
+    table_name TEXT NOT NULL,
+    row_id TEXT NOT NULL,
+    change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Newest transaction whose tombstones were pruned; older cursors must resync from scratch
+CREATE TABLE sync_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_xid xid8 NOT NULL DEFAULT '0'
+);
+
+INSERT INTO sync_horizon (id) VALUES (TRUE);
+
+CREATE OR REPLACE FUNCTION touch_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level so bulk deletes write their tombstones in one INSERT.
+-- TG_ARGV[0] is the column holding the owning user, TG_ARGV[1] the column
+-- identifying the row. Rows removed because their user was deleted are skipped.
+CREATE OR REPLACE FUNCTION record_deleted_rows() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO deleted_rows (user_id, table_name, row_id)
+         SELECT d.%1$I, %2$L, d.%3$I::text
+         FROM deleted_transition d
+         WHERE EXISTS (SELECT 1 FROM users u WHERE u.id = d.%1$I)',
+        TG_ARGV[0], TG_TABLE_NAME, TG_ARGV[1]
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER habits_touch_change_xid BEFORE UPDATE ON habits
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+CREATE TRIGGER pets_touch_change_xid BEFORE UPDATE ON pets
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+CREATE TRIGGER user_stats_touch_change_xid BEFORE UPDATE ON user_stats
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+CREATE TRIGGER notifications_touch_change_xid BEFORE UPDATE ON notifications
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+CREATE TRIGGER friends_touch_change_xid BEFORE UPDATE ON friends
+FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+
+CREATE TRIGGER habits_record_deleted AFTER DELETE ON habits
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+CREATE TRIGGER pets_record_deleted AFTER DELETE ON pets
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+CREATE TRIGGER user_stats_record_deleted AFTER DELETE ON user_stats
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'user_id');
+CREATE TRIGGER notifications_record_deleted AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'id');
+-- A friendship belongs to both users, so each side gets a tombstone naming the other
+CREATE TRIGGER friends_record_deleted AFTER DELETE ON friends
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('user_id', 'friend_id');
+CREATE TRIGGER friends_record_deleted_reverse AFTER DELETE ON friends
+REFERENCING OLD TABLE AS deleted_transition
+FOR EACH STATEMENT EXECUTE FUNCTION record_deleted_rows('friend_id', 'user_id');
+
+-- Unread notification count per user, maintained by the triggers below
+CREATE TABLE notification_counters (
+    user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    unread INTEGER NOT NULL DEFAULT 0
+);
+
+-- Applies the net change in unread notifications per user. Counter rows are
+-- locked in user order so concurrent multi-user statements cannot deadlock.
+CREATE OR REPLACE FUNCTION count_unread_notifications() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO notification_counters AS c (user_id, unread)
+        SELECT user_id, COUNT(*)
+        FROM new_rows
+        WHERE read = FALSE AND user_id IS NOT NULL
+        GROUP BY user_id
+        ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET unread = c.unread + EXCLUDED.unread;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO notification_counters AS c (user_id, unread)
+        SELECT n.user_id, SUM((n.read = FALSE)::int - (o.read = FALSE)::int)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        WHERE n.user_id IS NOT NULL
+        GROUP BY n.user_id
+        HAVING SUM((n.read = FALSE)::int - (o.read = FALSE)::int) <> 0
+        ORDER BY n.user_id
+        ON CONFLICT (user_id) DO UPDATE SET unread = GREATEST(0, c.unread + EXCLUDED.unread);
+    ELSE
+        -- Counter rows of deleted users are already gone, so nothing is recreated for them
+        UPDATE notification_counters c
+        SET unread = GREATEST(0, c.unread - removed.unread)
+        FROM (
+            SELECT user_id, COUNT(*) AS unread
+            FROM old_rows
+            WHERE read = FALSE
+            GROUP BY user_id
+            ORDER BY user_id
+        ) AS removed
+        WHERE c.user_id = removed.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notifications_count_insert AFTER INSERT ON notifications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+CREATE TRIGGER notifications_count_update AFTER UPDATE ON notifications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+CREATE TRIGGER notifications_count_delete AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_unread_notifications();
+
+-- Publishes notification changes on notifications_<user id>, see /api/notifications/stream
+CREATE OR REPLACE FUNCTION publish_notification_changes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'created',
+            'id', n.id,
+            'type', n.type,
+            'message', left(n.message, 2000),
+            'read', n.read,
+            'created_at', n.created_at,
+            'unread', c.unread
+        )::text)
+        FROM new_rows n
+        LEFT JOIN notification_counters c ON c.user_id = n.user_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM pg_notify('notifications_' || n.user_id, json_build_object(
+            'event', 'updated',
+            'id', n.id,
+            'read', n.read,
+            'unread', c.unread
+        )::text)
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        LEFT JOIN notification_counters c ON c.user_id = n.user_id
+        WHERE n.read IS DISTINCT FROM o.read;
+    ELSE
+        PERFORM pg_notify('notifications_' || o.user_id, json_build_object(
+            'event', 'deleted',
+            'id', o.id,
+            'read', o.read,
+            'unread', c.unread
+        )::text)
+        FROM old_rows o
+        LEFT JOIN notification_counters c ON c.user_id = o.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notifications_publish_insert AFTER INSERT ON notifications
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
+CREATE TRIGGER notifications_publish_update AFTER UPDATE ON notifications
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
+CREATE TRIGGER notifications_publish_delete AFTER DELETE ON notifications
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION publish_notification_changes();
+
+CREATE INDEX cookies_cookie_value_idx ON cookies (cookie_value);
+CREATE INDEX habits_user_id_idx ON habits (user_id);
+CREATE INDEX notifications_user_created_idx ON notifications (user_id, created_at DESC, id DESC);
+CREATE INDEX notifications_user_unread_idx ON notifications (user_id) WHERE read = FALSE;
+CREATE INDEX friends_friend_id_idx ON friends (friend_id);
+CREATE INDEX friend_requests_to_status_idx ON friend_requests (to_user_id, status);
+CREATE INDEX friend_requests_from_status_idx ON friend_requests (from_user_id, status);
+CREATE INDEX users_display_name_idx ON users (display_name);
+CREATE INDEX habit_completions_user_completed_idx ON habit_completions (user_id, completed_at DESC);
+CREATE INDEX habit_completions_habit_completed_idx ON habit_completions (habit_id, completed_at DESC);
+CREATE INDEX habits_user_change_idx ON habits (user_id, change_xid);
+CREATE INDEX notifications_user_change_idx ON notifications (user_id, change_xid);
+CREATE INDEX friends_user_change_idx ON friends (user_id, change_xid);
+CREATE INDEX friends_friend_change_idx ON friends (friend_id, change_xid);
+CREATE INDEX deleted_rows_user_change_idx ON deleted_rows (user_id, change_xid);
+CREATE INDEX deleted_rows_deleted_at_idx ON deleted_rows (deleted_at);
+CREATE INDEX notifications_type_created_idx ON notifications (type, created_at);
+
 -- TODO: authentication table for external sign-in 
 -- TODO: preset list of habits table
+
+-- This schema already includes every migration up to the newest one; record them so
+-- `flask migrate` on a fresh install only applies migrations added later. Add new
+-- migrations here as well when folding them into this file.
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    applied_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO schema_migrations (version, filename) VALUES
+    ('0001', '0001_add_profile_fields.sql'),
+    ('0002', '0002_add_session_generation.sql'),
+    ('0003', '0003_hot_lookup_indexes.sql'),
+    ('0004', '0004_habit_completions.sql'),
+    ('0005', '0005_pet_vitals_decay.sql'),
+    ('0006', '0006_achievement_catalog_version.sql'),
+    ('0007', '0007_global_leaderboard.sql'),
+    ('0008', '0008_weather_cells.sql'),
+    ('0009', '0009_change_tracking.sql'),
+    ('0010', '0010_notification_events.sql'),
+    ('0011', '0011_notification_counters.sql'),
+    ('0012', '0012_notification_retention_index.sql'),
+    ('0013', '0013_backfill_change_xid.sql')
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,133 @@
+"""
+Checks that the hot lookups in index.py are answered from the secondary
+indexes of migration 0003 rather than by sequential scans. The statements are
+imported from index.py, so the plans checked are those of the real queries.
+
+Runs against the Postgres database configured by the PG_* environment
+variables (or backend/.env) and is skipped when none is configured. The
+schema is created in a throwaway schema inside one transaction, seeded,
+analyzed and rolled back afterwards, so the database is left untouched.
+"""
+import json
+import os
+import uuid
+
+import pytest
+from dotenv import load_dotenv
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from backend import index  # noqa: E402
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "..", "schema.sql")
+SEED_USERS = 2000
+
+# (index that must appear in the plan, statement the route sends, its parameters given the user id)
+HOT_QUERIES = [
+    ("cookies_cookie_value_idx", index.SESSION_LOOKUP_SQL, lambda user_id: ("cookie-42",)),
+    ("habits_user_id_idx", index.HABITS_LIST_SQL, lambda user_id: (user_id,)),
+    (
+        "notifications_user_created_idx",
+        index.notifications_page_sql(["user_id = %(user_id)s"]),
+        lambda user_id: {"user_id": user_id, "limit": index.NOTIFICATIONS_PAGE_SIZE + 1}
+    ),
+    (
+        # PUT /api/notifications/read-all
+        "notifications_user_unread_idx",
+        index.mark_notifications_read_sql(["user_id = %(user_id)s"]),
+        lambda user_id: {"user_id": user_id}
+    ),
+    ("friends_friend_id_idx", index.FRIENDS_LIST_SQL, lambda user_id: (user_id, user_id)),
+    ("friend_requests_to_status_idx", index.INCOMING_FRIEND_REQUESTS_SQL, lambda user_id: (user_id,)),
+    ("friend_requests_from_status_idx", index.SENT_FRIEND_REQUESTS_SQL, lambda user_id: (user_id,)),
+    ("users_display_name_idx", index.USER_LOOKUP_SQL, lambda user_id: ("User 42", "User 42")),
+]
+
+
+def index_names(plan):
+    """
+    Returns the names of every index used anywhere in an EXPLAIN (FORMAT JSON) plan node tree.
+    """
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    if not os.environ.get("PG_HOST") or not os.environ.get("PG_DATABASE"):
+        pytest.skip("No Postgres database configured (PG_HOST, PG_DATABASE)")
+    conn = psycopg2.connect(
+        host=os.environ.get("PG_HOST"),
+        user=os.environ.get("PG_USER"),
+        password=os.environ.get("PG_PASSWORD"),
+        dbname=os.environ.get("PG_DATABASE"),
+        port=5432
+    )
+    schema = f"index_usage_{uuid.uuid4().hex[:8]}"
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {schema}")
+            cursor.execute(f"SET LOCAL search_path TO {schema}, public")
+            with open(SCHEMA_FILE) as f:
+                cursor.execute(f.read())
+            cursor.execute(
+                """
+                INSERT INTO users (email, display_name)
+                SELECT 'user-' || i || '@example.com', 'User ' || i
+                FROM generate_series(1, %s) AS i
+                """,
+                (SEED_USERS,)
+            )
+            cursor.execute(
+                """
+                CREATE TEMP TABLE seeded_users ON COMMIT DROP AS
+                SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS n FROM users
+                """
+            )
+            cursor.execute(
+                """
+                INSERT INTO cookies (user_id, cookie_value, expires_at)
+                SELECT id, 'cookie-' || n, NOW() + INTERVAL '7 days' FROM seeded_users;
+
+                INSERT INTO habits (user_id, name, recurrence_type)
+                SELECT id, 'Habit ' || h, 'daily' FROM seeded_users, generate_series(1, 5) AS h;
+
+                INSERT INTO notifications (user_id, type, message, read, created_at)
+                SELECT id, 'habit', 'Notification ' || k, k > 2, NOW() - make_interval(hours => k)
+                FROM seeded_users, generate_series(1, 20) AS k;
+
+                INSERT INTO friends (user_id, friend_id)
+                SELECT a.id, b.id
+                FROM seeded_users a
+                JOIN seeded_users b ON b.n IN (a.n %% %(users)s + 1, (a.n + 1) %% %(users)s + 1);
+
+                INSERT INTO friend_requests (from_user_id, to_user_id, status)
+                SELECT a.id, b.id, CASE WHEN a.n %% 4 = 0 THEN 'pending' ELSE 'accepted' END
+                FROM seeded_users a
+                JOIN seeded_users b ON b.n = (a.n + 9) %% %(users)s + 1;
+                """,
+                {"users": SEED_USERS}
+            )
+            for table in ("users", "cookies", "habits", "notifications", "friends", "friend_requests"):
+                cursor.execute(f"ANALYZE {table}")
+            cursor.execute("SELECT id FROM seeded_users WHERE n = 42")
+            user_id = cursor.fetchone()[0]
+        yield conn, user_id
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.mark.parametrize("index_name, query, params", HOT_QUERIES, ids=[query[0] for query in HOT_QUERIES])
+def test_hot_lookup_uses_index(seeded, index_name, query, params):
+    conn, user_id = seeded
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params(str(user_id)))
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    assert index_name in index_names(plan[0]["Plan"]), json.dumps(plan, indent=2)
@@ -0,0 +1,252 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import RefreshingCache
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+FALLBACK_WEATHER = "sunny"
+
+
+def weather_from_code(code):
+    """
+    Maps a WMO weather code from Open-Meteo to one of the pet's weather moods.
+    """
+    if code >= 0 and code <= 3:
+        return "sunny"
+    elif code == 45 or code == 48:
+        return "cloudy"
+    elif code >= 95 and code <= 99:
+        return "thunder"
+    elif (code >= 51 and code <= 67) or (code >= 80 and code <= 82):
+        return "rainy"
+    elif code >= 71 and code <= 77:
+        return "snowy"
+    else:
+        return "windy"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency. While closed, call outcomes from the
+    last window seconds are kept; once at least min_calls were made and the
+    failure ratio reaches failure_ratio the breaker opens and rejects calls for
+    open_seconds. It then lets a single probe call through (half-open): success
+    closes the breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_ratio=0.5, min_calls=10, window=60, open_seconds=30):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0
+        self._probing = False
+        self._outcomes = deque()  # (time, succeeded)
+        self._stats = {
+            "opened": 0,
+            "rejected": 0,
+            "failures": 0,
+            "successes": 0,
+        }
+
+    def allow(self):
+        """
+        Returns whether a call may go through right now.
+        """
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            self._record(True)
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._record(False)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+                self._open()
+
+    def _record(self, succeeded):
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded))
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {"state": state, **self._stats}
+
+
+class WeatherClient:
+    """
+    Current weather lookups against Open-Meteo, cached per grid cell.
+
+    Coordinates are snapped to cells of cell_degrees (0.1 degrees is roughly
+    11 km), so everyone in the same area shares one cache entry and one
+    upstream call. Entries are fresh for ttl seconds, which matches the
+    15 minute cadence of Open-Meteo's current conditions, and are served stale
+    for up to stale_ttl more seconds while a refresh runs or when upstream fails.
+
+    Upstream calls go through a circuit breaker and are abandoned after
+    latency_budget seconds, so a slow or failing Open-Meteo never ties up a
+    worker; without a cached value the fallback weather is returned instead.
+    """
+
+    def __init__(self, base_url=OPEN_METEO_URL, cell_degrees=0.1, ttl=900, stale_ttl=6 * 3600,
+                 maxsize=10000, timeout=(3, 5), latency_budget=2, pool_size=10,
+                 breaker=None, fallback=FALLBACK_WEATHER):
+        self.base_url = base_url
+        self.cell_degrees = cell_degrees
+        self.timeout = timeout  # (connect, read) seconds for the socket operations
+        self.latency_budget = latency_budget  # total seconds a caller waits for upstream
+        self.fallback = fallback
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = RefreshingCache(maxsize, ttl, stale_ttl)
+        # Upstream calls run here so callers can stop waiting once the budget is spent;
+        # the pool size also caps how many threads a hanging upstream can hold
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="open-meteo")
+        self._lock = threading.Lock()
+        self._stats = {
+            "fallbacks": 0,
+        }
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def cell(self, latitude, longitude):
+        """
+        Returns the (row, column) grid cell containing the coordinate. Matches
+        FLOOR(coordinate / cell_degrees) in SQL, which the prefetch job groups by.
+        """
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def cell_center(self, cell):
+        return (
+            round((cell[0] + 0.5) * self.cell_degrees, 4),
+            round((cell[1] + 0.5) * self.cell_degrees, 4)
+        )
+
+    def fetch_many(self, cells):
+        """
+        Fetches the current weather at the centre of every cell in one
+        multi-coordinate request, bypassing the cache. Returns {cell: weather}.
+        """
+        centers = [self.cell_center(cell) for cell in cells]
+        response = self.session.get(
+            self.base_url,
+            params={
+                "latitude": ",".join(str(latitude) for latitude, _ in centers),
+                "longitude": ",".join(str(longitude) for _, longitude in centers),
+                "current": "weather_code"
+            },
+            timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch weather data: {response.status_code}")
+        locations = response.json()
+        # A single coordinate is answered with an object, several with a list
+        if isinstance(locations, dict):
+            locations = [locations]
+        return {
+            cell: weather_from_code(location["current"]["weather_code"])
+            for cell, location in zip(cells, locations)
+        }
+
+    def fetch(self, cell):
+        """
+        Fetches the current weather at the centre of a cell, bypassing the cache.
+        """
+        return self.fetch_many([cell])[cell]
+
+    def guarded_fetch(self, cell):
+        """
+        Fetches a cell through the circuit breaker within the latency budget.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen("Weather service unavailable")
+        future = self._executor.submit(self.fetch, cell)
+        try:
+            weather = future.result(timeout=self.latency_budget)
+        except FutureTimeout:
+            self.breaker.record_failure()
+            raise Exception(f"Weather service did not answer within {self.latency_budget}s")
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return weather
+
+    def current(self, latitude, longitude, last_known=None):
+        """
+        Returns the current weather for a coordinate, fetching its cell at most
+        once at a time no matter how many requests miss concurrently. When
+        upstream fails, falls back to the cached weather, then to last_known,
+        then to the fallback.
+        """
+        cell = self.cell(latitude, longitude)
+        try:
+            return self.cache.get(cell, lambda: self.guarded_fetch(cell))
+        except Exception as e:
+            print(f"Weather lookup for cell {cell} failed, using fallback: {e}")
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return last_known or self.fallback
+
+    def stats(self):
+        with self._lock:
+            own = dict(self._stats)
+        return {
+            **self.cache.stats(),
+            **own,
+            "breaker": self.breaker.stats(),
+        }
@@ -0,0 +1,80 @@
+"""
+Local stand-in for the Open-Meteo forecast API, for exercising the weather
+client's timeouts, circuit breaker and fallbacks offline. Point OPEN_METEO_URL
+at it (e.g. http://127.0.0.1:8081/v1/forecast) and start it with
+`flask --app backend.index weather-stub --delay 3 --failure-rate 0.5`.
+"""
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubSettings:
+    def __init__(self, delay=0.0, jitter=0.0, failure_rate=0.0, failure_status=503, weather_code=0):
+        self.delay = delay  # seconds before every response
+        self.jitter = jitter  # extra random delay, up to this many seconds
+        self.failure_rate = failure_rate  # share of requests answered with failure_status
+        self.failure_status = failure_status
+        self.weather_code = weather_code
+        self.requests = 0
+
+
+def make_handler(settings):
+    class OpenMeteoStubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            settings.requests += 1
+            time.sleep(settings.delay + random.uniform(0, settings.jitter))
+            if random.random() < settings.failure_rate:
+                self._respond(settings.failure_status, {"error": True, "reason": "stubbed failure"})
+                return
+
+            query = parse_qs(urlparse(self.path).query)
+            latitudes = query.get("latitude", ["0"])[0].split(",")
+            longitudes = query.get("longitude", ["0"])[0].split(",")
+            if len(latitudes) != len(longitudes):
+                self._respond(400, {"error": True, "reason": "latitude and longitude must have the same length"})
+                return
+
+            locations = [
+                {
+                    "latitude": float(latitude),
+                    "longitude": float(longitude),
+                    "current": {"weather_code": settings.weather_code}
+                }
+                for latitude, longitude in zip(latitudes, longitudes)
+            ]
+            # Like Open-Meteo, a single coordinate gets an object and several get a list
+            self._respond(200, locations[0] if len(locations) == 1 else locations)
+
+        def _respond(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return OpenMeteoStubHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # load tests open many connections at once
+
+
+def serve(host="127.0.0.1", port=8081, settings=None):
+    """
+    Runs the stub until interrupted.
+    """
+    server = StubServer((host, port), make_handler(settings or StubSettings()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()